@@ -3,13 +3,14 @@ from langgraph.graph import StateGraph, START, END
 from typing import TypedDict, Optional, Dict
 import os
 import razorpay
-import requests
 import cloudinary
-import cloudinary.uploader
 import pdfkit
 from dotenv import load_dotenv
 import time
 import logging
+from resilience import CircuitOpenError, DeadlineExceeded, Deadline, get_breaker
+import whatsapp_outbox
+import pdf_store
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -39,6 +40,12 @@ except Exception as e:
     logging.error(f"Failed to initialize Razorpay client: {e}")
     client = None
 
+# Per-provider circuit breakers (shared process-wide with the other agents)
+razorpay_breaker = get_breaker("razorpay", excluded=(razorpay.errors.BadRequestError,))
+
+# Per-call timeout caps; the request deadline can only make them shorter
+RAZORPAY_TIMEOUT = 10
+
 # Cloudinary config
 cloudinary.config(
     cloud_name=CLOUD_NAME,
@@ -52,10 +59,14 @@ class InvoiceState(TypedDict):
     invoice_data: Dict
     pdf_path: Optional[str]
     pdf_url: Optional[str]
+    pdf_digest: Optional[str]
     payment_status: str
     razorpay_link_id: Optional[str]
     razorpay_payment_url: Optional[str]
     customer_phone: str
+    deadline_at: Optional[float]
+    invoice_message_id: Optional[int]
+    confirmation_message_id: Optional[int]
 
 # === Utility: UltraMsg endpoints ===
 def ultramsg_text_endpoint():
@@ -121,8 +132,9 @@ def create_payment_link(state: InvoiceState):
     
     logging.info("Using phone number for Razorpay: %s", phone)
     
+    deadline = Deadline.from_state(state)
     try:
-        payment = client.payment_link.create({
+        payment = razorpay_breaker.call(client.payment_link.create, {
             "amount": amount_in_paise,
             "currency": "INR",
             "description": f"Invoice #{data['invoice_number']}",
@@ -135,7 +147,7 @@ def create_payment_link(state: InvoiceState):
             },
             "callback_url": f"{SERVER_BASE_URL}/payment-success/{data['invoice_number']}",
             "callback_method": "get"
-        })
+        }, timeout=deadline.timeout(RAZORPAY_TIMEOUT))
         logging.info("Payment link created successfully: %s", payment.get("id"))
         return {
             "razorpay_link_id": payment.get("id"),
@@ -189,30 +201,18 @@ def generate_pdf(state: InvoiceState):
         logging.exception("PDFKit in-memory generation failed")
         raise
 
-    # === Upload PDF bytes to Cloudinary (pass credentials explicitly) ===
-    try:
-        upload_resp = cloudinary.uploader.upload(
-            pdf_bytes,
-            resource_type="raw",
-            public_id=f"invoices/invoice_{invoice_no}",
-            overwrite=True,
-            api_key=CLOUD_API_KEY,
-            api_secret=CLOUD_API_SECRET,
-            cloud_name=CLOUD_NAME
-        )
-        pdf_url = upload_resp.get("secure_url")
-        logging.info("Uploaded in-memory PDF to Cloudinary: %s", pdf_url)
-    except Exception:
-        logging.exception("Cloudinary upload failed")
-        raise
+    # === Store locally; Cloudinary upload happens in the background ===
+    digest = pdf_store.put(pdf_bytes)
+    pdf_path = pdf_store.path_for(digest)
+    pdf_url = pdf_store.local_url(digest)
+    pdf_store.schedule_upload(digest, f"invoices/invoice_{invoice_no}")
+    logging.info("Stored PDF %s; serving from %s until the CDN upload finishes", digest, pdf_url)
 
     # Update state with PDF info
-    state["pdf_path"] = None
+    state["pdf_path"] = pdf_path
     state["pdf_url"] = pdf_url
 
-    return {"pdf_path": None, "pdf_url": pdf_url}
-
-
+    return {"pdf_path": pdf_path, "pdf_url": pdf_url, "pdf_digest": digest}
 
 
 def send_whatsapp_invoice(state: InvoiceState):
@@ -228,21 +228,12 @@ def send_whatsapp_invoice(state: InvoiceState):
         "Please complete the payment using the above link."
     )
 
-    text_payload = {
-        "token": ULTRAMSG_TOKEN,
-        "to": phone,
-        "body": msg
-    }
-
-    text_url = ultramsg_text_endpoint()
-    try:
-        logging.info("Sending WhatsApp text via UltraMsg to %s", phone)
-        r = requests.post(text_url, data=text_payload, timeout=20)
-        logging.info("UltraMsg text response: %s %s", r.status_code, r.text)
-    except Exception:
-        logging.exception("UltraMsg text send failed")
-    
-    return {}
+    # Queued in the outbox; a sender thread delivers it with retries
+    message_id = whatsapp_outbox.enqueue(
+        phone, msg, dedup_key=f"invoice:{data['invoice_number']}:{state.get('razorpay_link_id')}"
+    )
+    logging.info("Queued WhatsApp invoice for %s as outbox message %s", phone, message_id)
+    return {"invoice_message_id": message_id}
 
 def wait_for_payment(state: InvoiceState):
     link_id = state.get("razorpay_link_id")
@@ -252,18 +243,25 @@ def wait_for_payment(state: InvoiceState):
 
     max_attempts = 6
     delay_seconds = 5
+    deadline = Deadline.from_state(state)
     for attempt in range(1, max_attempts + 1):
         try:
             logging.info("Polling Razorpay link status (attempt %s/%s)", attempt, max_attempts)
-            resp = client.payment_link.fetch(link_id)
+            resp = razorpay_breaker.call(client.payment_link.fetch, link_id, timeout=deadline.timeout(RAZORPAY_TIMEOUT))
             status = resp.get("status")
             logging.info("Razorpay link status: %s", status)
             if status in ("paid", "paid_partially"):
                 return {"payment_status": "paid"}
             elif status in ("cancelled", "expired"):
                 return {"payment_status": status}
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            logging.warning("Stopped polling Razorpay link %s: %s", link_id, e)
+            break
         except Exception:
             logging.exception("Error fetching Razorpay payment link status")
+        # Don't sleep past the request deadline
+        if deadline.remaining() < delay_seconds:
+            break
         time.sleep(delay_seconds)
 
     return {"payment_status": "pending"}
@@ -272,20 +270,11 @@ def send_payment_confirmation(state: InvoiceState):
     phone = state["customer_phone"]
     msg = "✅ Payment Received! Thank you — your invoice is settled."
 
-    text_payload = {
-        "token": ULTRAMSG_TOKEN,
-        "to": phone,
-        "body": msg
-    }
-    text_url = ultramsg_text_endpoint()
-    try:
-        logging.info("Sending payment confirmation via UltraMsg to %s", phone)
-        r = requests.post(text_url, data=text_payload, timeout=20)
-        logging.info("UltraMsg confirmation response: %s %s", r.status_code, r.text)
-    except Exception:
-        logging.exception("UltraMsg confirmation send failed")
-
-    return {}
+    message_id = whatsapp_outbox.enqueue(
+        phone, msg, dedup_key=f"payment_confirmation:{state.get('razorpay_link_id')}"
+    )
+    logging.info("Queued payment confirmation for %s as outbox message %s", phone, message_id)
+    return {"confirmation_message_id": message_id}
 
 # === LangGraph wiring ===
 graph = StateGraph(InvoiceState)
@@ -326,6 +315,6 @@ if __name__ == "__main__":
     print("\n--- SUMMARY ---")
     print("Razorpay Link ID:", result.get("razorpay_link_id"))
     print("Razorpay Payment URL:", result.get("razorpay_payment_url"))
-    print("PDF URL (Cloudinary):", result.get("pdf_url"))
+    print("PDF URL:", result.get("pdf_url"))
     print("Payment status:", result.get("payment_status"))
     print("If pending: open the payment url and complete test payment to observe confirmation.")
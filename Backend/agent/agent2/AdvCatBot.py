@@ -4,22 +4,22 @@ from typing_extensions import TypedDict, Annotated
 from dotenv import load_dotenv
 import os
 import logging
-import requests
 from firebase_utils import db
 from langgraph.prebuilt import ToolNode, tools_condition
 from langchain_core.tools import tool
 from langgraph.graph.message import add_messages
 from langchain_core.messages import BaseMessage, HumanMessage
-import razorpay
 import cloudinary
-import threading
-from langgraph.checkpoint.memory import MemorySaver
+from chat_checkpointer import SqliteCheckpointer
+from reminder_service import send_reminder
+from receivables import receivables_summary, SnapshotNotReady
 
 
 
 
 # ---- Memory (Persistent) ----
-checkpointer = MemorySaver()
+# SQLite on disk: survives restarts and is shared by all workers on the host
+checkpointer = SqliteCheckpointer()
 
 
 load_dotenv()
@@ -27,26 +27,11 @@ logging.basicConfig(level=logging.INFO)
 
 # ---- Load environment variables ----
 # Use the same env names as in Backend/.env
-RAZORPAY_KEY = os.getenv("RAZORPAY_KEY_ID")
-RAZORPAY_SECRET = os.getenv("RAZORPAY_KEY_SECRET")
 CLOUD_NAME = os.getenv("CLOUDINARY_CLOUD_NAME") or os.getenv("CLOUD_NAME")
 CLOUD_API_KEY = os.getenv("CLOUDINARY_API_KEY") or os.getenv("CLOUD_API_KEY")
 CLOUD_API_SECRET = os.getenv("CLOUDINARY_API_SECRET") or os.getenv("CLOUD_API_SECRET")
-ULTRAMSG_TOKEN = os.getenv("ULTRAMSG_TOKEN")
-ULTRAMSG_INSTANCE = os.getenv("ULTRAMSG_INSTANCE")
-SERVER_BASE_URL = os.getenv("SERVER_BASE_URL", "https://your-server.com")
 
 
-# ---- Razorpay client ----
-try:
-    if not RAZORPAY_KEY or not RAZORPAY_SECRET:
-        raise ValueError("Razorpay credentials missing in environment")
-    client = razorpay.Client(auth=(RAZORPAY_KEY, RAZORPAY_SECRET))
-    logging.info("Razorpay client initialized successfully (agent2)")
-except Exception as e:
-    logging.error("Failed to initialize Razorpay client (agent2): %s", e)
-    client = None
-
 # ---- Cloudinary config ----
 cloudinary.config(
     cloud_name=CLOUD_NAME,
@@ -72,95 +57,6 @@ class InputState(TypedDict):
     tool_input: dict
 
 
-# threading the razorpay
-logging.basicConfig(level=logging.INFO)
-
-def send_reminder(invoice_data, invoice_id=None):
-    try:
-        logging.info("===== send_reminder called =====")
-        logging.info("invoice_data: %s", invoice_data)
-        logging.info("================================")
-
-        # Write to debug file
-        debug_file = os.path.join(os.getcwd(), "debug_invoice.txt")
-        with open(debug_file, "a") as f:
-            f.write(str(invoice_data) + "\n")
-        logging.info(f"Invoice data written to {debug_file}")
-
-        # Prepare phone number
-        raw_phone = str(invoice_data["buyerInfo"]["contact"]).strip()
-        digits = "".join(filter(str.isdigit, raw_phone))
-        if len(digits) == 10:
-            digits = "91" + digits
-        elif len(digits) == 12 and digits.startswith("91"):
-            pass
-        else:
-            logging.error("[PHONE ERROR] Invalid phone number: %s", raw_phone)
-            return False
-        phone = "+" + digits
-        logging.info("[DEBUG] Final phone: %s", phone)
-
-        # Use invoice_id if provided, else fallback to Firestore doc ID
-        invoice_number = invoice_id or invoice_data.get("meta", {}).get("createdBy", "N/A")
-
-        # Razorpay payment link
-        amount_in_paise = int(float(invoice_data["total"]) * 100)
-        if client is None:
-            logging.error("[Reminder ERROR] Razorpay client not initialized. Check RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET in .env")
-            return False
-
-        payment = client.payment_link.create({
-            "amount": amount_in_paise,
-            "currency": "INR",
-            "description": f"Invoice #{invoice_number}",
-            "customer": {"contact": phone},
-            "notify": {"sms": True, "email": False},
-            "callback_url": f"{SERVER_BASE_URL}/payment-success/{invoice_number}",
-            "callback_method": "get"
-        })
-        payment_url = payment.get("short_url")
-        logging.info("[DEBUG] Razorpay Link: %s", payment_url)
-
-        # Message to customer
-        msg = (
-            f"⚠️ Payment Reminder\n"
-            f"Invoice #{invoice_number}\n"
-            f"Amount: ₹{invoice_data['total']}\n"
-            f"Pay now: {payment_url}"
-        )
-
-        # Send WhatsApp via UltraMsg
-        url = f"https://api.ultramsg.com/{ULTRAMSG_INSTANCE}/messages/chat"
-        payload = {
-            "token": ULTRAMSG_TOKEN,
-            "to": phone,
-            "body": msg,
-            "priority": "10"
-        }
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        response = requests.post(url, data=payload, headers=headers, timeout=20)
-
-        logging.info("[UltraMsg] Status: %s", response.status_code)
-        logging.info("[UltraMsg] Response: %s", response.text)
-        if "error" in response.text.lower():
-            logging.error("[UltraMsg ERROR] %s", response.text)
-
-        logging.info("========== REMINDER END ==========")
-
-        # Return True if UltraMsg returned success (HTTP 200 and no 'error' in body)
-        try:
-            if response is not None and response.status_code == 200 and "error" not in response.text.lower():
-                return True
-            else:
-                return False
-        except Exception:
-            return False
-
-    except Exception as e:
-        logging.error("[Reminder ERROR] %s", e)
-        return False
-
-
 # ---- Tools ----
 @tool
 def tool_pending_invoices(state: InputState) -> dict:
@@ -181,6 +77,22 @@ def tool_pending_invoices(state: InputState) -> dict:
     return {"result": pending}
 
 
+@tool
+def tool_receivables_summary(top: int = 5, include_customers: bool = False) -> dict:
+    """
+    Precomputed receivables figures: total outstanding amount and tax, number of
+    open invoices, aging buckets (0-30/31-60/61-90/90+ days, plus "unknown" for
+    invoices without a date) and the top debtors. Set include_customers=True to
+    also get the outstanding balance of every customer.
+    Use this for "how much is outstanding" or "who owes the most" questions
+    instead of adding up pending invoices yourself.
+    """
+    try:
+        return {"result": receivables_summary(top=top, include_customers=include_customers)}
+    except SnapshotNotReady as e:
+        return {"error": str(e)}
+
+
 @tool
 def tool_list_products(state: InputState) -> dict:
     """Returns the list of products."""
@@ -217,7 +129,7 @@ def get_customer_info(customer_name: str, trigger_reminder: bool = False):
 
             # ONLY SEND REMINDER IF USER EXPLICITLY ASKED
             if trigger_reminder:
-                send_reminder(data)
+                send_reminder(data, doc.id)
 
     if not results:
         return {"message": f"No customer found with name '{customer_name}'."}
@@ -269,7 +181,7 @@ def tool_send_payment_reminder(invoice_id: str) -> dict:
 
 
 # ---- LangGraph setup ----
-tools = [get_customer_info, tool_list_products, tool_pending_invoices , tool_send_payment_reminder]
+tools = [get_customer_info, tool_list_products, tool_pending_invoices , tool_send_payment_reminder, tool_receivables_summary]
 tool_node = ToolNode(tools)
 
 llm_with_tools = llm.bind_tools(tools)
@@ -280,13 +192,13 @@ def chat_node(state: InputState):
     res = llm_with_tools.invoke(messages)
     return {"messages": [res]}
 
-graph = StateGraph(InputState, checkpointer=checkpointer)
+graph = StateGraph(InputState)
 graph.add_node("chat_node", chat_node)
 graph.add_node("tools", tool_node)
 graph.add_edge(START, "chat_node")
 graph.add_conditional_edges("chat_node", tools_condition)
 graph.add_edge("tools", "chat_node")
-Bot = graph.compile()
+Bot = graph.compile(checkpointer=checkpointer)
 
 
 # while True:
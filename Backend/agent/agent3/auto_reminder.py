@@ -1,50 +1,43 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
-import requests
 import logging
 import os
 import schedule
 import time
-from datetime import datetime, timedelta
-import razorpay
 import json
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from firebase_utils import db
 from dotenv import load_dotenv
+from reminder_service import (
+    send_reminder, send_digest_reminder, normalize_phone, ReminderWriteBack, MAX_INVOICES_PER_DIGEST,
+)
+from reconcile_payments import reconcile_payments
+import profiling
 
 # Load environment variables
 load_dotenv()
 # ===== CONFIG =====
-ULTRAMSG_TOKEN = os.getenv("ULTRAMSG_TOKEN")
-ULTRAMSG_INSTANCE = os.getenv("ULTRAMSG_INSTANCE")
-SERVER_BASE_URL = "https://your-server.com"
-RAZORPAY_API_KEY = os.getenv("RAZORPAY_KEY_ID")
-RAZORPAY_API_SECRET = os.getenv("RAZORPAY_KEY_SECRET")
-print("ULTRAMSG TOKEN:", ULTRAMSG_TOKEN)
-print("ULTRAMSG INSTANCE:", ULTRAMSG_INSTANCE)
-
-
 # Scheduler interval (minutes)
 INTERVAL = 60
 
-# File to track already sent reminders
+# Legacy local ledger of already sent reminders. Reminder state now lives on the
+# invoice documents (reminder.lastRemindedAt / count / linkId); this file is only
+# read so invoices reminded before the migration are not reminded again.
 REMINDER_TRACK_FILE = "sent_reminders.json"
 
-def ultramsg_text_endpoint():
-    # Correct UltraMsg text message endpoint
-    return f"https://api.ultramsg.com/{ULTRAMSG_INSTANCE}/messages/text"
-
-
+# Sharding: one shard per sellerId, run in a process pool
+REMINDER_WORKERS = int(os.getenv("REMINDER_WORKERS", os.cpu_count() or 1))
+# Cycles with fewer shards run them in the scheduler process: the pool only
+# pays off once several sellers' network waits can overlap
+REMINDER_POOL_MIN_SHARDS = int(os.getenv("REMINDER_POOL_MIN_SHARDS", 4))
+# Fairness: a seller gets at most this many reminder messages per cycle
+SELLER_QUOTA_PER_CYCLE = int(os.getenv("SELLER_QUOTA_PER_CYCLE", 25))
+SELLER_RATE_PER_SEC = float(os.getenv("SELLER_RATE_PER_SEC", 1.0))
 
-# Razorpay client - initialize with error handling
-try:
-    client = razorpay.Client(auth=(RAZORPAY_API_KEY, RAZORPAY_API_SECRET))
-    logging.info("Razorpay client initialized successfully")
-except Exception as e:
-    logging.error("Failed to initialize Razorpay client: %s", e)
-    client = None
 
-
-# ===== Helper: Load/Save sent reminders =====
+# ===== Helper: Load legacy sent reminders =====
 def load_sent_reminders():
     if os.path.exists(REMINDER_TRACK_FILE):
         with open(REMINDER_TRACK_FILE, "r") as f:
@@ -52,114 +45,213 @@ def load_sent_reminders():
     return {}
 
 
-def save_sent_reminders(data):
-    with open(REMINDER_TRACK_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+def already_reminded(data, invoice_id, legacy_reminders):
+    if data.get("reminder", {}).get("lastRemindedAt"):
+        return True
+    return invoice_id in legacy_reminders
+
+
+# ===== Per-seller shards =====
+# Firestore has no case-insensitive match; these are the spellings of "pending"
+# the clients write (the pre-sharding scheduler compared status.lower()).
+PENDING_STATUSES = ["pending", "Pending", "PENDING"]
+
+
+def pending_query(seller_id=None):
+    query = db.collection('invoices').where("buyerInfo.status", "in", PENDING_STATUSES)
+    if seller_id is not None:
+        query = query.where("sellerId", "==", seller_id)
+    return query
+
+
+def discover_sellers():
+    """Seller ids that currently have pending invoices, plus the ids of pending
+    invoices without a sellerId (projection query, no payloads).
+
+    Older invoices were written without sellerId; they run in one catch-all
+    shard so they are still reminded.
+    """
+    sellers = set()
+    unassigned = []
+    for doc in pending_query().select(["sellerId"]).stream():
+        seller_id = (doc.to_dict() or {}).get("sellerId")
+        if seller_id:
+            sellers.add(seller_id)
+        else:
+            unassigned.append(doc.id)
+    return sorted(sellers), unassigned
+
+
+def shard_documents(seller_id, invoice_ids=None):
+    """Pending invoice snapshots of one shard: a seller, or the given unassigned ids."""
+    if invoice_ids is None:
+        return pending_query(seller_id).stream()
+    refs = [db.collection('invoices').document(invoice_id) for invoice_id in invoice_ids]
+    return (snap for snap in db.get_all(refs) if snap.exists)
+
+
+def group_by_customer(invoices):
+    """Group (invoice_id, data) pairs by normalized buyer contact, oldest customer first.
+
+    Invoices whose contact cannot be normalized are returned separately.
+    """
+    groups = {}
+    invalid = []
+    for invoice_id, data in invoices:
+        phone = normalize_phone(data.get("buyerInfo", {}).get("contact"))
+        if phone is None:
+            invalid.append(invoice_id)
+        else:
+            groups.setdefault(phone, []).append((invoice_id, data))
+
+    def oldest(group):
+        created = [d.get("createdAt") for _, d in group if hasattr(d.get("createdAt"), "timestamp")]
+        return min(c.timestamp() for c in created) if created else 0.0
+
+    return sorted(groups.values(), key=oldest), invalid
+
+
+def process_seller_shard(seller_id, invoice_ids=None):
+    """Send up to SELLER_QUOTA_PER_CYCLE digest reminders for one seller.
+
+    Runs in a worker process. A seller's pending, not yet reminded invoices are
+    grouped by customer, and each customer gets one WhatsApp message with one
+    combined payment link, so API calls scale with customers rather than
+    invoices. Customers over the quota are picked up in the next cycle, because
+    reminder state on the invoice documents is the ledger. This keeps one
+    seller's backlog from delaying every other seller.
+
+    With ``invoice_ids`` (and seller_id None) the shard covers those invoices
+    without a sellerId instead, under the same quota.
+    """
+    label = seller_id or "(no sellerId)"
+    legacy_reminders = load_sent_reminders()
+    write_back = ReminderWriteBack()
+    min_interval = 1.0 / SELLER_RATE_PER_SEC
+
+    candidates = []
+    for doc in shard_documents(seller_id, invoice_ids):
+        data = doc.to_dict()
+        if not already_reminded(data, doc.id, legacy_reminders):
+            candidates.append((doc.id, data))
 
+    groups, invalid = group_by_customer(candidates)
+    if invalid:
+        logging.warning("Seller %s: skipping %d invoices with invalid contact", label, len(invalid))
 
-# ===== Send Reminder =====
-def send_reminder(invoice_data, invoice_id=None):
-    try:
-        logging.info("Sending reminder for invoice: %s", invoice_id)
-
-        if client is None:
-            logging.error("[Reminder ERROR] Razorpay client not initialized. Check RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET in .env")
-            return False
-
-        raw_phone = str(invoice_data["buyerInfo"]["contact"]).strip()
-        digits = "".join(filter(str.isdigit, raw_phone))
-
-        if len(digits) == 10:
-            digits = "91" + digits
-        phone = "+" + digits  # UltraMsg requires + prefix
-
-        invoice_number = invoice_id or "N/A"
-        amount_in_paise = int(float(invoice_data["total"]) * 100)
-
-        payment = client.payment_link.create({
-            "amount": amount_in_paise,
-            "currency": "INR",
-            "description": f"Invoice #{invoice_number}",
-            "customer": {"contact": phone},
-            "notify": {"sms": True, "email": False},
-            "callback_url": f"{SERVER_BASE_URL}/payment-success/{invoice_number}",
-            "callback_method": "get"
-        })
-
-        payment_url = payment.get("short_url")
-
-        msg = (
-            f"⚠️ Payment Reminder\n"
-            f"Invoice #{invoice_number}\n"
-            f"Amount: ₹{invoice_data['total']}\n"
-            f"Pay now: {payment_url}"
-        )
-
-        url = f"https://api.ultramsg.com/{ULTRAMSG_INSTANCE}/messages/chat"
-        
-        payload = {
-            "token": ULTRAMSG_TOKEN,
-            "to": phone,
-            "body": msg,
-            "priority": "10"
-        }
-
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        response = requests.post(url, data=payload, headers=headers, timeout=20)
-
-        logging.info("UltraMsg response: %s %s", response.status_code, response.text)
-
-        if "error" in response.text.lower():
-            return False
+    sent_list = []
+    digests = 0
+    last_send = 0.0
+    for group in groups:
+        for i in range(0, len(group), MAX_INVOICES_PER_DIGEST):
+            if digests >= SELLER_QUOTA_PER_CYCLE:
+                break
+            digest = group[i:i + MAX_INVOICES_PER_DIGEST]
+
+            # Per-seller rate limit
+            wait = min_interval - (time.monotonic() - last_send)
+            if wait > 0:
+                time.sleep(wait)
+            last_send = time.monotonic()
+
+            digests += 1
+            if len(digest) == 1:
+                ok = send_reminder(digest[0][1], invoice_id=digest[0][0], write_back=write_back)
+            else:
+                ok = send_digest_reminder(digest, write_back=write_back)
+            if ok:
+                sent_list.extend(invoice_id for invoice_id, _ in digest)
+
+    # One batched Firestore commit per shard per cycle
+    write_back.commit()
+    logging.info("Seller %s: %d messages for %d pending invoices", label, digests, len(candidates))
+    return seller_id, sent_list
 
-        return True
 
-    except Exception as e:
-        logging.error("[Reminder ERROR] %s", e)
-        return False
+# ===== Shard process pool =====
+_pool = None
+_pool_lock = threading.Lock()
 
 
+def _init_shard_worker():
+    # Spawned children start without the parent's logging setup
+    logging.basicConfig(level=logging.INFO)
 
 
+def _get_pool():
+    """One pool for the life of the scheduler.
+
+    Spawned workers import the entry module (the Flask app, both graphs and
+    the LLM client) once, not every cycle, and keep their circuit breakers
+    across cycles so a failing provider still trips them.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: gRPC channels of the Firestore client must not cross a fork
+            ctx = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(max_workers=REMINDER_WORKERS, mp_context=ctx,
+                                        initializer=_init_shard_worker)
+        return _pool
+
+
+def _discard_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+atexit.register(_discard_pool)
 
 
 # ===== Fetch pending invoices and send reminders =====
 def process_pending_invoices():
     logging.info("==== Checking pending invoices ====")
-    sent_reminders = load_sent_reminders()
-    invoices_ref = db.collection('invoices')
-    docs = invoices_ref.stream()
-
-    sent_count = 0
-    sent_list = []
-
-    for doc in docs:
-        data = doc.to_dict()
-        invoice_id = doc.id
-        buyer_info = data.get("buyerInfo", {})
-        status = buyer_info.get("status", "").lower()
-
-        # Send only if pending and not already sent
-        if status == "pending" and invoice_id not in sent_reminders:
-            success = send_reminder(data, invoice_id=invoice_id)
-            if success:
-                sent_reminders[invoice_id] = datetime.now().isoformat()
-                sent_count += 1
-                sent_list.append(invoice_id)
-
-    save_sent_reminders(sent_reminders)
-    logging.info(f"==== Completed. Total reminders sent: {sent_count} ====")
+    # Pick up payments made since the last cycle so paid invoices are skipped
+    try:
+        reconcile_payments()
+    except Exception:
+        logging.exception("Payment reconciliation failed; continuing with reminders")
+
+    sellers, unassigned = discover_sellers()
+    shards = [(seller_id, None) for seller_id in sellers]
+    if unassigned:
+        logging.info("%d pending invoices without sellerId go to the catch-all shard", len(unassigned))
+        shards.append((None, unassigned))
+
+    results = []
+    if REMINDER_WORKERS <= 1 or len(shards) < REMINDER_POOL_MIN_SHARDS:
+        for seller_id, invoice_ids in shards:
+            results.append(process_seller_shard(seller_id, invoice_ids))
+    else:
+        pool = _get_pool()
+        futures = {pool.submit(process_seller_shard, seller_id, invoice_ids): seller_id
+                   for seller_id, invoice_ids in shards}
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except BrokenProcessPool:
+                logging.exception("Reminder shard for seller %s lost with its worker", futures[future])
+            except Exception:
+                logging.exception("Reminder shard for seller %s failed", futures[future])
+        if any(isinstance(f.exception(), BrokenProcessPool) for f in futures):
+            # A worker died; start a fresh pool next cycle
+            _discard_pool()
+
+    sent_list = [invoice_id for _, sent in results for invoice_id in sent]
+    logging.info(f"==== Completed. {len(shards)} shards, total reminders sent: {len(sent_list)} ====")
     if sent_list:
         logging.info("Invoices reminded: %s", sent_list)
 
 
-# ===== Scheduler =====
 # ===== Scheduler =====
 def start_scheduler(interval_seconds=5):  # change to seconds for testing
-    schedule.every(interval_seconds).seconds.do(process_pending_invoices)
+    # Every PROFILE_CYCLE_EVERY-th cycle is stack-sampled when profiling is enabled
+    schedule.every(interval_seconds).seconds.do(profiling.sampled_cycle(process_pending_invoices))
     logging.info(f"Scheduler started. Reminders will run every {interval_seconds} seconds.")
 
     while True:
         schedule.run_pending()
         time.sleep(1)
-
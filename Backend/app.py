@@ -1,9 +1,19 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, redirect, send_file, abort
 from flask_cors import CORS
 import logging
+import os
 from agent.agent1.invoice import workflow
 from agent.agent2.AdvCatBot import Bot
 from agent.agent3.auto_reminder import start_scheduler
+from resilience import CircuitOpenError, DeadlineExceeded, Deadline, breaker_states
+import whatsapp_outbox
+import pdf_store
+import statements
+import receivables
+import invoice_stats
+import idempotency
+import profiling
+from datetime import datetime, timedelta, timezone
 from langchain_core.messages import HumanMessage
 import threading
 
@@ -13,6 +23,9 @@ app = Flask(__name__)
 
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+# No-op unless PROFILING_ENABLED=1
+profiling.init_app(app)
+
 
 
 # ------------------------------
@@ -20,7 +33,7 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 # ------------------------------
 @app.route("/api/health", methods=["GET"])
 def health():
-    return jsonify({"status": "ok", "message": "Agent running"})
+    return jsonify({"status": "ok", "message": "Agent running", "circuits": breaker_states()})
 
 
 # ------------------------------
@@ -40,6 +53,16 @@ def create_invoice():
         if invoice_data is None or customer_phone is None:
             return jsonify({"error": "Missing required fields"}), 400
 
+        # Client retries must not create another payment link / PDF / WhatsApp message
+        idempotency_key = request.headers.get("Idempotency-Key")
+        if not idempotency_key and invoice_data.get("invoice_number") is not None:
+            idempotency_key = f"invoice:{invoice_data['invoice_number']}"
+        if idempotency_key:
+            replay = idempotency.begin(idempotency_key, idempotency.fingerprint(payload))
+            if replay is not None:
+                status_code, body = replay
+                return jsonify(body), status_code, {"Idempotent-Replayed": "true"}
+
         # Build state exactly like your FastAPI version
         state = {
             "invoice_data": invoice_data,
@@ -49,13 +72,31 @@ def create_invoice():
             "razorpay_link_id": None,
             "razorpay_payment_url": None,
             "customer_phone": customer_phone,
+            "deadline_at": Deadline.after().deadline_at,
         }
 
         # workflow.invoke is synchronous
-        result = workflow.invoke(state)
+        try:
+            result = workflow.invoke(state)
+        except Exception:
+            if idempotency_key:
+                idempotency.release(idempotency_key)
+            raise
 
+        if idempotency_key:
+            idempotency.complete(idempotency_key, 200, result)
         return jsonify(result)
 
+    except idempotency.IdempotencyConflict as e:
+        return jsonify({"error": str(e)}), 422
+
+    except idempotency.IdempotencyTimeout as e:
+        return jsonify({"error": str(e)}), 409
+
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        logging.warning("Workflow shed: %s", e)
+        return jsonify({"error": str(e)}), 503
+
     except Exception as e:
         logging.exception("Workflow failed")
         return jsonify({"error": str(e)}), 500
@@ -78,6 +119,118 @@ def payment_success(invoice_number):
         logging.exception("Payment callback error")
         return jsonify({"error": str(e)}), 500
 
+# ------------------------------
+# Invoice PDF Download
+# ------------------------------
+@app.route("/api/pdf/<digest>", methods=["GET"])
+def download_pdf(digest):
+    if not pdf_store.is_digest(digest):
+        abort(404)
+
+    # Once the background upload is done, hand the download off to the CDN
+    cdn_url = pdf_store.cdn_url(digest)
+    if cdn_url:
+        return redirect(cdn_url)
+
+    path = pdf_store.path_for(digest)
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(path, mimetype="application/pdf")
+
+# ------------------------------
+# Customer Statement (all invoices in one PDF)
+# ------------------------------
+def _statement_bound(value, end=False):
+    """ISO date or datetime -> aware UTC datetime. Naive values are taken as
+    UTC like createdAt; an offset is converted, not dropped. A date-only ``to``
+    becomes midnight of the next day, since the query's upper bound is exclusive."""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    else:
+        parsed = parsed.astimezone(timezone.utc)
+    if end and "T" not in value and " " not in value.strip():
+        parsed += timedelta(days=1)
+    return parsed
+
+
+@app.route("/api/statement", methods=["GET"])
+def customer_statement():
+    try:
+        contact = request.args.get("contact")
+        customer_name = request.args.get("name")
+        if not contact and not customer_name:
+            return jsonify({"error": "contact or name is required"}), 400
+
+        # Optional range; both days are included (see _statement_bound)
+        start = end = None
+        if request.args.get("from"):
+            start = _statement_bound(request.args["from"])
+        if request.args.get("to"):
+            end = _statement_bound(request.args["to"], end=True)
+
+        result = statements.create_statement(
+            contact=contact,
+            customer_name=customer_name,
+            seller_id=request.args.get("seller_id"),
+            start=start,
+            end=end,
+        )
+        return jsonify(result)
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.exception("Statement generation failed")
+        return jsonify({"error": str(e)}), 500
+
+# ------------------------------
+# Receivables Analytics
+# ------------------------------
+@app.route("/api/analytics/receivables", methods=["GET"])
+def receivables_analytics():
+    try:
+        top = int(request.args.get("top", 5))
+        if top < 0:
+            return jsonify({"error": "top must be a non-negative integer"}), 400
+        # ?customers=1 adds every owing customer's balance, not just the top ones
+        summary = receivables.receivables_summary(
+            top=top,
+            seller_id=request.args.get("seller_id"),
+            include_customers=request.args.get("customers") in ("1", "true"),
+        )
+        return jsonify(summary)
+
+    except ValueError:
+        return jsonify({"error": "top must be an integer"}), 400
+    except receivables.SnapshotNotReady as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        logging.exception("Receivables analytics failed")
+        return jsonify({"error": str(e)}), 500
+
+# ------------------------------
+# Dashboard Counters
+# ------------------------------
+@app.route("/api/dashboard/invoice-stats", methods=["GET"])
+def dashboard_invoice_stats():
+    try:
+        return jsonify(invoice_stats.get_invoice_stats(request.args.get("seller_id")))
+
+    except Exception as e:
+        logging.exception("Invoice stats aggregation failed")
+        return jsonify({"error": str(e)}), 500
+
+# ------------------------------
+# WhatsApp Outbox Delivery Status
+# ------------------------------
+@app.route("/api/outbox/<int:message_id>", methods=["GET"])
+def outbox_status(message_id):
+    message = whatsapp_outbox.get_message(message_id)
+    if message is None:
+        return jsonify({"error": "Message not found"}), 404
+    return jsonify(message)
+
 # ------------------------------
 # ChatBot
 # ------------------------------
@@ -117,6 +270,14 @@ def agent_endpoint():
 # Start Flask App
 # ------------------------------
 if __name__ == "__main__":
+    # With debug=True the Werkzeug reloader runs this block in a watcher process
+    # too; background workers only belong in the process that serves requests
+    if not app.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        # Deliver WhatsApp messages queued before a restart
+        whatsapp_outbox.start_sender_pool()
+        # Finish Cloudinary uploads interrupted by a restart
+        pdf_store.resume_pending_uploads()
+
     # Start the reminders scheduler in a background thread so Flask isn't blocked
     # try:
     #     scheduler_thread = threading.Thread(target=start_scheduler, args=(5,), daemon=True)
@@ -0,0 +1,146 @@
+# audit_log.py
+# Structured audit-event stream. Callers only pay for a queue put; a single
+# background thread batches events into JSON lines and rotates the file by size.
+#
+# Every process (app workers, reminder shard workers) runs its own writer on the
+# same file, so the size check, rotation and append happen under an exclusive
+# flock on audit_events.jsonl.lock.
+import atexit
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development only
+    fcntl = None
+
+# ===== CONFIG =====
+AUDIT_LOG_DIR = os.getenv("AUDIT_LOG_DIR", os.path.join(os.getcwd(), "logs"))
+AUDIT_LOG_FILE = os.path.join(AUDIT_LOG_DIR, "audit_events.jsonl")
+AUDIT_LOCK_FILE = AUDIT_LOG_FILE + ".lock"
+AUDIT_MAX_BYTES = int(os.getenv("AUDIT_MAX_BYTES", 10 * 1024 * 1024))
+AUDIT_BACKUP_COUNT = int(os.getenv("AUDIT_BACKUP_COUNT", 5))
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", 10000))
+AUDIT_BATCH_SIZE = 200
+AUDIT_FLUSH_INTERVAL = 1.0  # seconds
+
+_queue = queue.Queue(maxsize=AUDIT_QUEUE_SIZE)
+_writer_thread = None
+_writer_lock = threading.Lock()
+_stop = threading.Event()
+dropped_events = 0
+
+
+# ===== Public API =====
+def emit(step, invoice_id=None, outcome=None, duration_ms=None, **fields):
+    """Enqueue one audit event. Never blocks; drops the event if the queue is full."""
+    global dropped_events
+    event = {
+        "ts": time.time(),
+        "invoice_id": invoice_id,
+        "step": step,
+        "outcome": outcome,
+        "duration_ms": duration_ms,
+    }
+    if fields:
+        event.update(fields)
+
+    _ensure_writer()
+    try:
+        _queue.put_nowait(event)
+    except queue.Full:
+        dropped_events += 1
+
+
+# ===== Background writer =====
+def _ensure_writer():
+    global _writer_thread
+    if _writer_thread is not None:
+        return
+    with _writer_lock:
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=_writer_loop, name="audit-writer", daemon=True)
+            _writer_thread.start()
+            atexit.register(_shutdown)
+
+
+def _writer_loop():
+    os.makedirs(AUDIT_LOG_DIR, exist_ok=True)
+    while not _stop.is_set() or not _queue.empty():
+        try:
+            first = _queue.get(timeout=AUDIT_FLUSH_INTERVAL)
+        except queue.Empty:
+            continue
+
+        batch = [first]
+        while len(batch) < AUDIT_BATCH_SIZE:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        try:
+            _write_batch(batch)
+        except Exception:
+            logging.exception("Audit log write failed (%d events lost)", len(batch))
+        finally:
+            for _ in batch:
+                _queue.task_done()
+
+
+def _write_batch(batch):
+    lines = []
+    for event in batch:
+        event["ts"] = datetime.fromtimestamp(event["ts"], timezone.utc).isoformat()
+        lines.append(json.dumps(event, default=str, ensure_ascii=False))
+    data = ("\n".join(lines) + "\n").encode("utf-8")
+
+    with _file_lock():
+        if os.path.exists(AUDIT_LOG_FILE) and os.path.getsize(AUDIT_LOG_FILE) + len(data) > AUDIT_MAX_BYTES:
+            _rotate()
+
+        with open(AUDIT_LOG_FILE, "ab") as f:
+            f.write(data)
+
+
+@contextmanager
+def _file_lock():
+    """Exclusive lock shared by the writers of all processes on this host."""
+    if fcntl is None:
+        yield
+        return
+    with open(AUDIT_LOCK_FILE, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _rotate():
+    """Shift audit_events.jsonl.N.gz backups and compress the current file into .1.gz.
+
+    Called with _file_lock held, so no other process appends or rotates meanwhile.
+    """
+    for i in range(AUDIT_BACKUP_COUNT - 1, 0, -1):
+        src = f"{AUDIT_LOG_FILE}.{i}.gz"
+        if os.path.exists(src):
+            os.replace(src, f"{AUDIT_LOG_FILE}.{i + 1}.gz")
+
+    with open(AUDIT_LOG_FILE, "rb") as src, gzip.open(f"{AUDIT_LOG_FILE}.1.gz", "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(AUDIT_LOG_FILE)
+
+
+def _shutdown():
+    _stop.set()
+    if _writer_thread is not None:
+        _writer_thread.join(timeout=5.0)
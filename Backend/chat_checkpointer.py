@@ -0,0 +1,508 @@
+# chat_checkpointer.py
+# SQLite-backed LangGraph checkpointer for the chatbot graph.
+#
+# Channel values are stored once per (channel, version) in a blobs table and a
+# checkpoint only references them, so a turn writes the channels that changed.
+# The `messages` channel holds the whole conversation (add_messages), so it is
+# not stored as one blob per version: each message is written once to an
+# append-only message_log, and a version only records which log rows make up
+# its list (as [start, end] seq ranges, a single range while the conversation
+# is append-only). A turn therefore serializes just its new messages.
+#
+# Old checkpoints are compacted per thread, idle threads expire after a TTL,
+# and WAL mode lets several workers on one host share the file.
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    CheckpointTuple,
+)
+
+# ===== CONFIG =====
+CHAT_DB = os.getenv("CHAT_CHECKPOINT_DB", os.path.join(os.getcwd(), "chat_checkpoints.db"))
+CHAT_THREAD_TTL_SECONDS = int(os.getenv("CHAT_THREAD_TTL_SECONDS", 7 * 24 * 60 * 60))
+# Checkpoints kept per thread after compaction (the latest is what a turn resumes from)
+CHAT_KEEP_CHECKPOINTS = int(os.getenv("CHAT_KEEP_CHECKPOINTS", 5))
+COMPACT_EVERY_PUTS = 10
+EXPIRE_INTERVAL_SECONDS = 300
+# Channels whose value is an append-mostly list, stored as message_log deltas
+DELTA_CHANNELS = ("messages",)
+MSGLOG_TYPE = "msglog"
+# Threads whose latest message list is kept in memory to diff the next put against
+MESSAGE_CACHE_THREADS = 128
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns)
+);
+CREATE INDEX IF NOT EXISTS idx_threads_updated ON threads (updated_at);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    type TEXT NOT NULL,
+    blob BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS message_log (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    blob BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, seq)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    blob BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+class SqliteCheckpointer(BaseCheckpointSaver):
+    """Synchronous checkpointer for Bot.invoke(); one SQLite connection per thread."""
+
+    def __init__(self, path=CHAT_DB, ttl_seconds=CHAT_THREAD_TTL_SECONDS,
+                 keep_checkpoints=CHAT_KEEP_CHECKPOINTS, serde=None):
+        super().__init__(serde=serde)
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.keep_checkpoints = keep_checkpoints
+        self._local = threading.local()
+        self._puts = 0
+        self._last_expire = 0.0
+        self._counter_lock = threading.Lock()
+        # (thread_id, checkpoint_ns, channel) -> (runs, tuple of messages) of the latest list
+        self._lists = OrderedDict()
+        self._lists_lock = threading.Lock()
+        with self._cursor() as cur:
+            cur.executescript(SCHEMA)
+
+    # ===== Connection =====
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _cursor(self, transaction=False):
+        conn = self._conn()
+        cur = conn.cursor()
+        if transaction:
+            cur.execute("BEGIN IMMEDIATE")
+        try:
+            yield cur
+            if transaction:
+                cur.execute("COMMIT")
+        except Exception:
+            if transaction:
+                cur.execute("ROLLBACK")
+            raise
+        finally:
+            cur.close()
+
+    # ===== Read =====
+    def get_tuple(self, config):
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = configurable.get("checkpoint_id")
+
+        with self._cursor() as cur:
+            if checkpoint_id:
+                cur.execute(
+                    "SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata "
+                    "FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                )
+            else:
+                cur.execute(
+                    "SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata "
+                    "FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                )
+            row = cur.fetchone()
+            if row is None:
+                return None
+            return self._load_tuple(cur, thread_id, checkpoint_ns, row)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        query = ("SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, "
+                 "metadata_type, metadata FROM checkpoints")
+        where, params = [], []
+        if config:
+            where.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                where.append("checkpoint_ns = ?")
+                params.append(config["configurable"]["checkpoint_ns"])
+        if before:
+            where.append("checkpoint_id < ?")
+            params.append(before["configurable"]["checkpoint_id"])
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY checkpoint_id DESC"
+
+        with self._cursor() as cur:
+            rows = cur.execute(query, params).fetchall()
+            returned = 0
+            for thread_id, checkpoint_ns, *row in rows:
+                if limit is not None and returned >= limit:
+                    break
+                tup = self._load_tuple(cur, thread_id, checkpoint_ns, row)
+                if filter and not all(tup.metadata.get(k) == v for k, v in filter.items()):
+                    continue
+                returned += 1
+                yield tup
+
+    def _load_tuple(self, cur, thread_id, checkpoint_ns, row):
+        checkpoint_id, parent_id, type_, checkpoint_blob, metadata_type, metadata_blob = row
+        checkpoint = self.serde.loads_typed((type_, checkpoint_blob))
+        checkpoint["channel_values"] = self._load_blobs(cur, thread_id, checkpoint_ns, checkpoint["channel_versions"])
+
+        cur.execute(
+            "SELECT task_id, channel, type, blob FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        )
+        pending_writes = [
+            (task_id, channel, self.serde.loads_typed((wtype, wblob)))
+            for task_id, channel, wtype, wblob in cur.fetchall()
+        ]
+
+        return CheckpointTuple(
+            config={"configurable": {
+                "thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id,
+            }},
+            checkpoint=checkpoint,
+            metadata=self.serde.loads_typed((metadata_type, metadata_blob)),
+            parent_config={"configurable": {
+                "thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_id,
+            }} if parent_id else None,
+            pending_writes=pending_writes,
+        )
+
+    def _load_blobs(self, cur, thread_id, checkpoint_ns, channel_versions):
+        values = {}
+        for channel, version in channel_versions.items():
+            cur.execute(
+                "SELECT type, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, str(version)),
+            )
+            row = cur.fetchone()
+            if row is None or row[0] == "empty":
+                continue
+            if row[0] == MSGLOG_TYPE:
+                runs = json.loads(row[1])
+                items = self._load_list(cur, thread_id, checkpoint_ns, channel, runs)
+                self._remember_list(thread_id, checkpoint_ns, channel, runs, items)
+                values[channel] = items
+            else:
+                values[channel] = self.serde.loads_typed(row)
+        return values
+
+    def _load_list(self, cur, thread_id, checkpoint_ns, channel, runs):
+        items = []
+        for start, end in runs:
+            cur.execute(
+                "SELECT type, blob FROM message_log WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? "
+                "AND seq BETWEEN ? AND ? ORDER BY seq",
+                (thread_id, checkpoint_ns, channel, start, end),
+            )
+            items.extend(self.serde.loads_typed(row) for row in cur.fetchall())
+        return items
+
+    # ===== Message list deltas =====
+    def _remember_list(self, thread_id, checkpoint_ns, channel, runs, items):
+        key = (thread_id, checkpoint_ns, channel)
+        with self._lists_lock:
+            self._lists[key] = (runs, tuple(items))
+            self._lists.move_to_end(key)
+            while len(self._lists) > MESSAGE_CACHE_THREADS:
+                self._lists.popitem(last=False)
+
+    def _forget_lists(self, thread_id, checkpoint_ns=None):
+        with self._lists_lock:
+            for key in [k for k in self._lists if k[0] == thread_id and checkpoint_ns in (None, k[1])]:
+                del self._lists[key]
+
+    def _base_list(self, cur, thread_id, checkpoint_ns, channel, parent_id):
+        """(runs, items) of a list already in message_log to diff a new value against.
+
+        The cached latest list is used while its rows still exist; otherwise the
+        parent checkpoint's list is read once.
+        """
+        with self._lists_lock:
+            cached = self._lists.get((thread_id, checkpoint_ns, channel))
+        if cached and cached[0]:
+            # Compaction or expiry in another process may have removed its rows
+            present = 0
+            for start, end in cached[0]:
+                cur.execute(
+                    "SELECT COUNT(*) FROM message_log WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? "
+                    "AND seq BETWEEN ? AND ?",
+                    (thread_id, checkpoint_ns, channel, start, end),
+                )
+                present += cur.fetchone()[0]
+            if present == len(cached[1]):
+                return [list(run) for run in cached[0]], cached[1]
+        if parent_id is None:
+            return [], ()
+        cur.execute(
+            "SELECT type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            (thread_id, checkpoint_ns, parent_id),
+        )
+        row = cur.fetchone()
+        if row is None:
+            return [], ()
+        version = self.serde.loads_typed(row)["channel_versions"].get(channel)
+        cur.execute(
+            "SELECT type, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+            (thread_id, checkpoint_ns, channel, str(version)),
+        )
+        row = cur.fetchone()
+        if row is None or row[0] != MSGLOG_TYPE:
+            return [], ()
+        runs = json.loads(row[1])
+        return runs, tuple(self._load_list(cur, thread_id, checkpoint_ns, channel, runs))
+
+    def _write_list(self, cur, thread_id, checkpoint_ns, channel, items, parent_id):
+        """Append the messages not already in the base list; return the new runs."""
+        base_runs, base_items = self._base_list(cur, thread_id, checkpoint_ns, channel, parent_id)
+        common = 0
+        for old, new in zip(base_items, items):
+            if old is not new and old != new:
+                break
+            common += 1
+
+        runs = _take_runs(base_runs, common)
+        new_items = items[common:]
+        if new_items:
+            cur.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM message_log WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ?",
+                (thread_id, checkpoint_ns, channel),
+            )
+            first = cur.fetchone()[0] + 1
+            cur.executemany(
+                "INSERT INTO message_log (thread_id, checkpoint_ns, channel, seq, type, blob) VALUES (?, ?, ?, ?, ?, ?)",
+                [(thread_id, checkpoint_ns, channel, first + i, *self.serde.dumps_typed(item))
+                 for i, item in enumerate(new_items)],
+            )
+            last = first + len(new_items) - 1
+            if runs and runs[-1][1] == first - 1:
+                runs[-1] = [runs[-1][0], last]
+            else:
+                runs.append([first, last])
+        return runs
+
+    # ===== Write =====
+    def put(self, config, checkpoint, metadata, new_versions):
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        parent_id = configurable.get("checkpoint_id")
+
+        # Only channels whose version moved are serialized; the rest are referenced.
+        # Delta channels are written inside the transaction, as message_log rows.
+        stored = dict(checkpoint)
+        values = stored.pop("channel_values", {})
+        blob_rows = []
+        delta = {}
+        for channel, version in new_versions.items():
+            if channel in DELTA_CHANNELS and isinstance(values.get(channel), list):
+                delta[channel] = version
+                continue
+            if channel in values:
+                type_, blob = self.serde.dumps_typed(values[channel])
+            else:
+                type_, blob = "empty", None
+            blob_rows.append((thread_id, checkpoint_ns, channel, str(version), type_, blob))
+
+        type_, checkpoint_blob = self.serde.dumps_typed(stored)
+        metadata_type, metadata_blob = self.serde.dumps_typed(dict(metadata))
+
+        written = {}
+        with self._cursor(transaction=True) as cur:
+            for channel, version in delta.items():
+                runs = self._write_list(cur, thread_id, checkpoint_ns, channel, values[channel], parent_id)
+                written[channel] = runs
+                blob_rows.append((thread_id, checkpoint_ns, channel, str(version), MSGLOG_TYPE,
+                                  json.dumps(runs, separators=(",", ":"))))
+            cur.executemany(
+                "INSERT OR IGNORE INTO blobs (thread_id, checkpoint_ns, channel, version, type, blob) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                blob_rows,
+            )
+            cur.execute(
+                "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+                "type, checkpoint, metadata_type, metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint["id"], parent_id, type_, checkpoint_blob,
+                 metadata_type, metadata_blob),
+            )
+            cur.execute(
+                "INSERT OR REPLACE INTO threads (thread_id, checkpoint_ns, updated_at) VALUES (?, ?, ?)",
+                (thread_id, checkpoint_ns, time.time()),
+            )
+        for channel, runs in written.items():
+            self._remember_list(thread_id, checkpoint_ns, channel, runs, values[channel])
+
+        self._maintain(thread_id, checkpoint_ns)
+        return {"configurable": {
+            "thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"],
+        }}
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = configurable["checkpoint_id"]
+
+        # Special writes (errors, interrupts) replace earlier ones; regular writes are kept once
+        verb = "INSERT OR REPLACE" if all(w[0] in WRITES_IDX_MAP for w in writes) else "INSERT OR IGNORE"
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, blob = self.serde.dumps_typed(value)
+            rows.append((thread_id, checkpoint_ns, checkpoint_id, task_id,
+                         WRITES_IDX_MAP.get(channel, idx), channel, type_, blob, task_path))
+        with self._cursor(transaction=True) as cur:
+            cur.executemany(
+                f"{verb} INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, blob, "
+                "task_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def delete_thread(self, thread_id):
+        with self._cursor(transaction=True) as cur:
+            for table in ("checkpoints", "blobs", "message_log", "writes", "threads"):
+                cur.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+        self._forget_lists(thread_id)
+
+    # ===== Compaction / TTL =====
+    def _maintain(self, thread_id, checkpoint_ns):
+        with self._counter_lock:
+            self._puts += 1
+            compact = self._puts % COMPACT_EVERY_PUTS == 0
+            now = time.time()
+            expire = now - self._last_expire >= EXPIRE_INTERVAL_SECONDS
+            if expire:
+                self._last_expire = now
+        if compact:
+            self.compact(thread_id, checkpoint_ns)
+        if expire:
+            self.expire()
+
+    def compact(self, thread_id, checkpoint_ns=""):
+        """Keep the newest ``keep_checkpoints`` checkpoints of a thread and drop
+        the writes, channel blobs and message_log rows nothing references any more."""
+        with self._cursor(transaction=True) as cur:
+            cur.execute(
+                "SELECT checkpoint_id, type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                "ORDER BY checkpoint_id DESC",
+                (thread_id, checkpoint_ns),
+            )
+            rows = cur.fetchall()
+            if len(rows) <= self.keep_checkpoints:
+                return 0
+
+            kept, dropped = rows[:self.keep_checkpoints], rows[self.keep_checkpoints:]
+            referenced = set()
+            for _, type_, blob in kept:
+                for channel, version in self.serde.loads_typed((type_, blob))["channel_versions"].items():
+                    referenced.add((channel, str(version)))
+
+            dropped_ids = [(thread_id, checkpoint_ns, row[0]) for row in dropped]
+            cur.executemany(
+                "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", dropped_ids
+            )
+            cur.executemany(
+                "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", dropped_ids
+            )
+
+            cur.execute(
+                "SELECT channel, version FROM blobs WHERE thread_id = ? AND checkpoint_ns = ?",
+                (thread_id, checkpoint_ns),
+            )
+            stale = [(thread_id, checkpoint_ns, channel, version)
+                     for channel, version in cur.fetchall() if (channel, version) not in referenced]
+            cur.executemany(
+                "DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?", stale
+            )
+
+            # message_log rows outside every kept list's runs
+            cur.execute(
+                "SELECT channel, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND type = ?",
+                (thread_id, checkpoint_ns, MSGLOG_TYPE),
+            )
+            kept_runs = {}
+            for channel, blob in cur.fetchall():
+                kept_runs.setdefault(channel, []).extend(json.loads(blob))
+            cur.execute(
+                "SELECT channel, seq FROM message_log WHERE thread_id = ? AND checkpoint_ns = ?",
+                (thread_id, checkpoint_ns),
+            )
+            unused = [(thread_id, checkpoint_ns, channel, seq) for channel, seq in cur.fetchall()
+                      if not any(start <= seq <= end for start, end in kept_runs.get(channel, ()))]
+            cur.executemany(
+                "DELETE FROM message_log WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND seq = ?", unused
+            )
+            return len(dropped)
+
+    def expire(self):
+        """Delete every thread that has not been written for ``ttl_seconds``."""
+        cutoff = time.time() - self.ttl_seconds
+        with self._cursor(transaction=True) as cur:
+            cur.execute("SELECT thread_id, checkpoint_ns FROM threads WHERE updated_at < ?", (cutoff,))
+            expired = cur.fetchall()
+            for table in ("checkpoints", "blobs", "message_log", "writes", "threads"):
+                cur.executemany(f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ?", expired)
+        for thread_id, checkpoint_ns in expired:
+            self._forget_lists(thread_id, checkpoint_ns)
+        return len(expired)
+
+
+def _take_runs(runs, count):
+    """The first ``count`` seqs of ``runs`` as a new list of [start, end] runs."""
+    taken = []
+    for start, end in runs:
+        if count <= 0:
+            break
+        n = min(end - start + 1, count)
+        taken.append([start, start + n - 1])
+        count -= n
+    return taken
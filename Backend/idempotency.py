@@ -0,0 +1,107 @@
+# idempotency.py
+# Idempotency keys for POST /api/invoice. The first request with a key runs the
+# workflow; concurrent duplicates wait for it, later duplicates get the stored
+# result back without calling Razorpay, Cloudinary or UltraMsg again.
+# Backed by SQLite so all workers on a host share it.
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# ===== CONFIG =====
+IDEMPOTENCY_DB = os.getenv("IDEMPOTENCY_DB", os.path.join(os.getcwd(), "idempotency.db"))
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", 24 * 60 * 60))
+# An in-progress claim older than this is assumed to belong to a dead worker
+STALE_SECONDS = 120
+WAIT_TIMEOUT_SECONDS = 90
+POLL_SECONDS = 0.25
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    status TEXT NOT NULL,
+    status_code INTEGER,
+    response TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+_local = threading.local()
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used with a different request body."""
+
+
+class IdempotencyTimeout(Exception):
+    """A duplicate waited too long for the in-flight request to finish."""
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(IDEMPOTENCY_DB, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def fingerprint(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def begin(key, request_fingerprint):
+    """Claim ``key`` or wait for whoever holds it.
+
+    Returns None when the caller owns the key and must run the request, or
+    (status_code, response_dict) when a stored result should be replayed.
+    """
+    conn = _connect()
+    deadline = time.monotonic() + WAIT_TIMEOUT_SECONDS
+    while True:
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (now - IDEMPOTENCY_TTL_SECONDS,))
+            row = conn.execute("SELECT * FROM idempotency_keys WHERE key = ?", (key,)).fetchone()
+            if row is None or (row["status"] == IN_PROGRESS and now - row["updated_at"] > STALE_SECONDS):
+                conn.execute(
+                    "INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, status, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, request_fingerprint, IN_PROGRESS, now, now),
+                )
+                conn.execute("COMMIT")
+                return None
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if row["fingerprint"] != request_fingerprint:
+            raise IdempotencyConflict(f"Idempotency key '{key}' was used with a different request")
+        if row["status"] == COMPLETED:
+            return row["status_code"], json.loads(row["response"])
+        if time.monotonic() >= deadline:
+            raise IdempotencyTimeout(f"Request with idempotency key '{key}' is still in progress")
+        time.sleep(POLL_SECONDS)
+
+
+def complete(key, status_code, response):
+    _connect().execute(
+        "UPDATE idempotency_keys SET status = ?, status_code = ?, response = ?, updated_at = ? WHERE key = ?",
+        (COMPLETED, status_code, json.dumps(response, default=str), time.time(), key),
+    )
+
+
+def release(key):
+    """Drop the claim after a failure so a retry runs the request again."""
+    _connect().execute("DELETE FROM idempotency_keys WHERE key = ? AND status = ?", (key, IN_PROGRESS))
@@ -0,0 +1,76 @@
+# invoice_stats.py
+# Dashboard counters (invoice count and total amount per status, optionally per
+# seller) computed with Firestore aggregation queries, so a refresh costs one
+# aggregation per status instead of streaming every invoice document.
+import threading
+import time
+
+from google.cloud.firestore_v1.base_query import FieldFilter, Or
+
+from firebase_utils import db
+
+# Statuses the dashboard shows; invoices with no status count as draft,
+# mirroring RealtimeInvoiceCounter on the frontend.
+STATUSES = ("paid", "pending", "sent", "overdue", "cancelled")
+UNPAID_STATUSES = ("pending", "sent", "overdue")
+CACHE_TTL_SECONDS = 15
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _aggregate(query):
+    """Run count(*) and sum(total) on the server in a single round trip."""
+    agg = query.count(alias="count").sum("total", alias="amount")
+    values = {result.alias: result.value for result in agg.get()[0]}
+    return {
+        "count": int(values.get("count") or 0),
+        "amount": round(float(values.get("amount") or 0), 2),
+    }
+
+
+def compute_invoice_stats(seller_id=None):
+    base = db.collection("invoices")
+    if seller_id:
+        base = base.where(filter=FieldFilter("sellerId", "==", seller_id))
+
+    totals = _aggregate(base)
+    by_status = {}
+    for status in STATUSES:
+        # Status lives on the invoice or on buyerInfo depending on the writer
+        query = base.where(filter=Or([
+            FieldFilter("status", "==", status),
+            FieldFilter("buyerInfo.status", "==", status),
+        ]))
+        by_status[status] = _aggregate(query)
+
+    by_status["draft"] = {
+        "count": max(totals["count"] - sum(s["count"] for s in by_status.values()), 0),
+        "amount": round(max(totals["amount"] - sum(s["amount"] for s in by_status.values()), 0), 2),
+    }
+
+    return {
+        "seller_id": seller_id,
+        "total": totals,
+        "by_status": by_status,
+        # Same statuses receivables.py treats as outstanding
+        "unpaid": {
+            "count": sum(by_status[s]["count"] for s in UNPAID_STATUSES),
+            "amount": round(sum(by_status[s]["amount"] for s in UNPAID_STATUSES), 2),
+        },
+        "computed_at": time.time(),
+    }
+
+
+def get_invoice_stats(seller_id=None):
+    """Cached per seller for CACHE_TTL_SECONDS, so dashboard refreshes within the TTL cost nothing."""
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(seller_id)
+        if cached and now - cached[0] < CACHE_TTL_SECONDS:
+            return cached[1]
+
+    stats = compute_invoice_stats(seller_id)
+    with _cache_lock:
+        _cache[seller_id] = (now, stats)
+    return stats
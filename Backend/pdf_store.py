@@ -0,0 +1,228 @@
+# pdf_store.py
+# Local content-addressed store for rendered invoice PDFs. A PDF is written to
+# disk and served from /api/pdf/<digest> right away; the Cloudinary upload runs
+# in a bounded background pool, after which the same URL redirects to the CDN.
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cloudinary
+import cloudinary.uploader
+from dotenv import load_dotenv
+
+from resilience import CircuitOpenError, get_breaker
+
+load_dotenv()
+
+# ===== CONFIG =====
+CLOUD_NAME = os.getenv("CLOUDINARY_CLOUD_NAME")
+CLOUD_API_KEY = os.getenv("CLOUDINARY_API_KEY")
+CLOUD_API_SECRET = os.getenv("CLOUDINARY_API_SECRET")
+SERVER_BASE_URL = os.getenv("SERVER_BASE_URL", "https://your-server.com")
+PDF_STORE_DIR = os.getenv("PDF_STORE_DIR", os.path.join(os.getcwd(), "pdf_store"))
+PDF_STORE_DB = os.path.join(PDF_STORE_DIR, "uploads.db")
+UPLOAD_CONCURRENCY = int(os.getenv("CLOUDINARY_UPLOAD_CONCURRENCY", 2))
+UPLOAD_MAX_ATTEMPTS = 5
+CLOUDINARY_TIMEOUT = 60
+# A pending row untouched for this long is not being worked on by any live process
+UPLOAD_LEASE_SECONDS = 5 * CLOUDINARY_TIMEOUT
+
+PENDING = "pending"
+UPLOADED = "uploaded"
+FAILED = "failed"
+
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    digest TEXT PRIMARY KEY,
+    public_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    cdn_url TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated_at REAL NOT NULL
+);
+"""
+
+cloudinary_breaker = get_breaker("cloudinary")
+
+_local = threading.local()
+_executor = None
+_executor_lock = threading.Lock()
+_queued = set()  # digests submitted to this process's pool and not finished yet
+_queued_lock = threading.Lock()
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(PDF_STORE_DIR, exist_ok=True)
+        conn = sqlite3.connect(PDF_STORE_DB, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+# ===== Blob store =====
+def is_digest(value):
+    return bool(DIGEST_RE.match(value or ""))
+
+
+def path_for(digest):
+    return os.path.join(PDF_STORE_DIR, digest[:2], f"{digest}.pdf")
+
+
+def local_url(digest):
+    """Stable URL for a stored PDF; the route serves it locally or redirects to the CDN."""
+    return f"{SERVER_BASE_URL}/api/pdf/{digest}"
+
+
+def put(pdf_bytes):
+    """Write the PDF under its SHA-256 and return the digest. Identical PDFs are stored once."""
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+    path = path_for(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(pdf_bytes)
+        os.replace(tmp, path)
+    return digest
+
+
+def put_file(src_path):
+    """Move an already rendered PDF into the store without reading it into memory."""
+    h = hashlib.sha256()
+    with open(src_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    path = path_for(digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(src_path)
+    else:
+        os.replace(src_path, path)
+    return digest
+
+
+def cdn_url(digest):
+    row = _connect().execute(
+        "SELECT cdn_url FROM uploads WHERE digest = ? AND status = ?", (digest, UPLOADED)
+    ).fetchone()
+    return row["cdn_url"] if row else None
+
+
+# ===== Background uploader =====
+def schedule_upload(digest, public_id):
+    """Queue the Cloudinary upload of a stored PDF. Already uploaded digests are skipped."""
+    conn = _connect()
+    row = conn.execute("SELECT status FROM uploads WHERE digest = ?", (digest,)).fetchone()
+    if row and row["status"] == UPLOADED:
+        return
+    conn.execute(
+        "INSERT INTO uploads (digest, public_id, status, updated_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(digest) DO UPDATE SET public_id = excluded.public_id, status = excluded.status, "
+        "updated_at = excluded.updated_at",
+        (digest, public_id, PENDING, time.time()),
+    )
+    _submit(digest, public_id)
+
+
+def resume_pending_uploads():
+    """Re-queue uploads interrupted by a restart. Call once at startup.
+
+    Only rows untouched for UPLOAD_LEASE_SECONDS are taken, and they are
+    claimed by bumping updated_at in the same transaction, so a worker starting
+    next to a live one (or a second process started by the reloader) does not
+    upload the same PDFs again.
+    """
+    conn = _connect()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            "SELECT digest, public_id FROM uploads WHERE status = ? AND updated_at < ?",
+            (PENDING, now - UPLOAD_LEASE_SECONDS),
+        ).fetchall()
+        conn.executemany("UPDATE uploads SET updated_at = ? WHERE digest = ?", [(now, row["digest"]) for row in rows])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    for row in rows:
+        _submit(row["digest"], row["public_id"])
+    if rows:
+        logging.info("Resumed %d pending Cloudinary uploads", len(rows))
+
+
+def _submit(digest, public_id):
+    with _queued_lock:
+        if digest in _queued:
+            return
+        _queued.add(digest)
+    _get_executor().submit(_upload, digest, public_id)
+
+
+def _get_executor():
+    global _executor
+    if _executor is not None:
+        return _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY, thread_name_prefix="pdf-upload")
+    return _executor
+
+
+def _upload(digest, public_id):
+    try:
+        _upload_with_retries(digest, public_id)
+    finally:
+        with _queued_lock:
+            _queued.discard(digest)
+
+
+def _upload_with_retries(digest, public_id):
+    conn = _connect()
+    path = path_for(digest)
+    for attempt in range(1, UPLOAD_MAX_ATTEMPTS + 1):
+        try:
+            resp = cloudinary_breaker.call(
+                cloudinary.uploader.upload,
+                path,
+                resource_type="raw",
+                public_id=public_id,
+                overwrite=True,
+                api_key=CLOUD_API_KEY,
+                api_secret=CLOUD_API_SECRET,
+                cloud_name=CLOUD_NAME,
+                timeout=CLOUDINARY_TIMEOUT
+            )
+            conn.execute(
+                "UPDATE uploads SET status = ?, cdn_url = ?, attempts = ?, last_error = NULL, updated_at = ? WHERE digest = ?",
+                (UPLOADED, resp.get("secure_url"), attempt, time.time(), digest),
+            )
+            logging.info("Uploaded %s to Cloudinary: %s", public_id, resp.get("secure_url"))
+            return
+        except CircuitOpenError as e:
+            error = str(e)
+        except Exception as e:
+            logging.warning("Cloudinary upload of %s failed (attempt %d): %s", public_id, attempt, e)
+            error = f"{type(e).__name__}: {e}"
+
+        conn.execute(
+            "UPDATE uploads SET attempts = ?, last_error = ?, updated_at = ? WHERE digest = ?",
+            (attempt, error, time.time(), digest),
+        )
+        time.sleep(min(2 ** attempt, 60))
+
+    conn.execute("UPDATE uploads SET status = ?, updated_at = ? WHERE digest = ?", (FAILED, time.time(), digest))
+    logging.error("Giving up Cloudinary upload of %s; PDF stays served locally", public_id)
@@ -0,0 +1,261 @@
+# profiling.py
+# Opt-in profiling for live requests and reminder cycles.
+#
+# Disabled unless PROFILING_ENABLED=1: then no hooks are registered and the
+# reminder cycle is not wrapped, so there is no overhead at all.
+#
+# When enabled:
+#   - a request with "X-Profile: 1" and a valid "X-Profile-Token" is run under
+#     cProfile; POST /api/admin/profile/arm profiles the next N requests to a path
+#     (for clients that can't send headers);
+#   - every PROFILE_CYCLE_EVERY-th reminder cycle is sampled by a stack sampler;
+#   - the last PROFILE_KEEP profiles are kept in profiles/ and can be listed and
+#     downloaded from /api/admin/profiles.
+import cProfile
+import functools
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+# ===== CONFIG =====
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.getcwd(), "profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 20))
+PROFILE_CYCLE_EVERY = int(os.getenv("PROFILE_CYCLE_EVERY", 10))
+SAMPLE_INTERVAL_SECONDS = 0.01
+
+PROFILE_NAME_RE = re.compile(r"^[\w.-]+\.(prof|folded)$")
+
+_armed = {}  # path -> remaining requests to profile
+_armed_lock = threading.Lock()
+_store_lock = threading.Lock()
+# cProfile can only be active once per process (3.12+ raises ValueError for a
+# second one), so overlapping requests are profiled one at a time
+_profile_lock = threading.Lock()
+
+
+# ===== Storage =====
+def _save(kind, label, suffix, write_fn, duration_ms):
+    """Write one profile and prune everything but the newest PROFILE_KEEP."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe_label = re.sub(r"[^\w-]+", "_", label).strip("_") or "root"
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{kind}-{safe_label}.{suffix}"
+    path = os.path.join(PROFILE_DIR, name)
+    write_fn(path)
+    with open(path + ".json", "w") as f:
+        json.dump({"name": name, "kind": kind, "label": label, "duration_ms": duration_ms,
+                   "created_at": time.time()}, f)
+
+    with _store_lock:
+        profiles = sorted(n for n in os.listdir(PROFILE_DIR) if PROFILE_NAME_RE.match(n))
+        for old in profiles[:-PROFILE_KEEP]:
+            for p in (old, old + ".json"):
+                try:
+                    os.remove(os.path.join(PROFILE_DIR, p))
+                except FileNotFoundError:
+                    pass
+    logging.info("Saved %s profile %s (%.1f ms)", kind, name, duration_ms)
+    return name
+
+
+def list_profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    out = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if PROFILE_NAME_RE.match(name) and os.path.exists(os.path.join(PROFILE_DIR, name + ".json")):
+            with open(os.path.join(PROFILE_DIR, name + ".json")) as f:
+                out.append(json.load(f))
+    return out
+
+
+def profile_path(name):
+    if not PROFILE_NAME_RE.match(name or ""):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.exists(path) else None
+
+
+def profile_text(path, limit=50):
+    """Top functions by cumulative time, for reading a .prof without pstats locally."""
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+# ===== Stack sampler =====
+class StackSampler:
+    """Samples one thread's Python stack every SAMPLE_INTERVAL_SECONDS and counts
+    collapsed stacks ("outer;...;inner"), the flamegraph .folded format.
+
+    Cost grows with the sampling rate, not with the number of calls, so it is
+    suitable for long reminder cycles where cProfile would distort timings.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL_SECONDS):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def sampled_cycle(fn, every=None):
+    """Wrap the reminder cycle so every ``every``-th run is stack-sampled.
+
+    Only the calling process is sampled; seller shards running in the process
+    pool appear as time spent waiting on their futures.
+    """
+    if not PROFILING_ENABLED:
+        return fn
+    every = every or PROFILE_CYCLE_EVERY
+    runs = {"n": 0}
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        runs["n"] += 1
+        if runs["n"] % every:
+            return fn(*args, **kwargs)
+
+        sampler = StackSampler(threading.get_ident())
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            sampler.stop()
+            duration_ms = (time.perf_counter() - start) * 1000
+            _save("cycle", fn.__name__, "folded", sampler.write, duration_ms)
+
+    return wrapper
+
+
+# ===== Flask integration =====
+def _authorized(req):
+    token = req.headers.get("X-Profile-Token", "")
+    return bool(PROFILING_TOKEN) and hmac.compare_digest(token, PROFILING_TOKEN)
+
+
+def _take_armed(path):
+    with _armed_lock:
+        remaining = _armed.get(path, 0)
+        if remaining <= 0:
+            return False
+        if remaining == 1:
+            del _armed[path]
+        else:
+            _armed[path] = remaining - 1
+        return True
+
+
+def init_app(app):
+    """Register profiling hooks and admin routes; does nothing unless enabled."""
+    if not PROFILING_ENABLED:
+        return
+    if not PROFILING_TOKEN:
+        logging.warning("PROFILING_ENABLED is set but PROFILING_TOKEN is not; admin routes will reject all calls")
+
+    from flask import g, jsonify, request, send_file, abort
+
+    @app.before_request
+    def _start_profile():
+        wanted = request.headers.get("X-Profile") == "1" and _authorized(request)
+        if not (wanted or _armed):
+            return
+        # Busy with another request: serve this one unprofiled, keeping any armed slot
+        if not _profile_lock.acquire(blocking=False):
+            return
+        if not (wanted or _take_armed(request.path)):
+            _profile_lock.release()
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # Another profiling tool (debugger, sys.setprofile user) is active
+            _profile_lock.release()
+            logging.warning("Skipping request profile: %s", e)
+            return
+        g._profiler = profiler
+        g._profile_start = time.perf_counter()
+
+    @app.teardown_request
+    def _stop_profile(exc):
+        profiler = g.pop("_profiler", None)
+        if profiler is None:
+            return
+        profiler.disable()
+        _profile_lock.release()
+        duration_ms = (time.perf_counter() - g.pop("_profile_start")) * 1000
+        try:
+            _save("request", f"{request.method}-{request.path}", "prof", profiler.dump_stats, duration_ms)
+        except Exception:
+            logging.exception("Failed to save request profile")
+
+    @app.route("/api/admin/profile/arm", methods=["POST"])
+    def arm_profile():
+        if not _authorized(request):
+            abort(403)
+        body = request.get_json(silent=True) or {}
+        path = body.get("path")
+        if not path:
+            return jsonify({"error": "path is required"}), 400
+        try:
+            count = max(1, int(body.get("count", 1)))
+        except (TypeError, ValueError):
+            return jsonify({"error": "count must be an integer"}), 400
+        with _armed_lock:
+            _armed[path] = count
+        return jsonify({"armed": path, "count": count})
+
+    @app.route("/api/admin/profiles", methods=["GET"])
+    def get_profiles():
+        if not _authorized(request):
+            abort(403)
+        return jsonify({"profiles": list_profiles()})
+
+    @app.route("/api/admin/profiles/<name>", methods=["GET"])
+    def download_profile(name):
+        if not _authorized(request):
+            abort(403)
+        path = profile_path(name)
+        if path is None:
+            abort(404)
+        if request.args.get("format") == "text" and name.endswith(".prof"):
+            return profile_text(path), 200, {"Content-Type": "text/plain; charset=utf-8"}
+        return send_file(path, as_attachment=True, download_name=name)
+
+    logging.info("Profiling enabled; profiles are stored in %s", PROFILE_DIR)
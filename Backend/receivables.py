@@ -0,0 +1,209 @@
+# receivables.py
+# Columnar (NumPy) snapshot of the invoices collection, kept up to date by a
+# Firestore listener, for receivables questions: outstanding total, aging
+# buckets, per-customer balances and top debtors.
+import logging
+import threading
+import time
+
+import numpy as np
+
+from firebase_utils import db
+from reminder_service import normalize_phone
+
+# Statuses that count as outstanding, matched case-insensitively. Drafts and
+# invoices without a status are not receivables, matching the dashboard counters.
+OPEN_STATUSES = ("pending", "sent", "overdue")
+# Upper bounds (days) of the aging buckets; the last bucket is open-ended
+AGING_EDGES = (30, 60, 90)
+AGING_LABELS = ("0-30", "31-60", "61-90", "90+")
+# Open invoices without a usable createdAt cannot be aged
+UNKNOWN_AGE_LABEL = "unknown"
+INITIAL_CAPACITY = 1024
+FIRST_LOAD_WAIT_SECONDS = 30
+
+
+class SnapshotNotReady(Exception):
+    """Raised while the listener has not delivered the initial load of the collection."""
+
+
+class ReceivablesSnapshot:
+    """Invoices as parallel NumPy columns, one row per invoice document.
+
+    Rows are updated in place on change and tombstoned on delete, so an update
+    costs O(1) and every query is a handful of vectorized passes.
+    """
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self._lock = threading.Lock()
+        self.row_of = {}           # invoice id -> row
+        self.ids = []
+        self.buyer_keys = {}       # normalized contact (or name) -> code
+        self.buyer_names = []
+        self.seller_keys = {}      # sellerId -> code
+        self.size = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.total = np.zeros(capacity, dtype=np.float64)
+        self.tax = np.zeros(capacity, dtype=np.float64)
+        self.created = np.full(capacity, np.nan, dtype=np.float64)   # epoch seconds, NaN if unknown
+        self.is_open = np.zeros(capacity, dtype=bool)
+        self.live = np.zeros(capacity, dtype=bool)
+        self.buyer = np.zeros(capacity, dtype=np.int32)
+        self.seller = np.zeros(capacity, dtype=np.int32)
+
+    def _grow(self):
+        old = (self.total, self.tax, self.created, self.is_open, self.live, self.buyer, self.seller)
+        self._allocate(len(self.total) * 2)
+        for new, prev in zip((self.total, self.tax, self.created, self.is_open, self.live, self.buyer, self.seller), old):
+            new[:len(prev)] = prev
+
+    def _code(self, table, key, name=None):
+        code = table.get(key)
+        if code is None:
+            code = table[key] = len(table)
+            if table is self.buyer_keys:
+                self.buyer_names.append(name or key)
+        return code
+
+    # ===== Incremental updates =====
+    def upsert(self, invoice_id, data):
+        buyer = data.get("buyerInfo", {}) or {}
+        status = (data.get("status") or buyer.get("status") or "").strip().lower()
+        buyer_name = buyer.get("name") or ""
+        buyer_key = normalize_phone(buyer.get("contact")) or buyer_name.strip().lower() or "unknown"
+        created = data.get("createdAt")
+
+        with self._lock:
+            row = self.row_of.get(invoice_id)
+            if row is None:
+                if self.size == len(self.total):
+                    self._grow()
+                row = self.size
+                self.size += 1
+                self.row_of[invoice_id] = row
+                self.ids.append(invoice_id)
+
+            self.total[row] = _to_float(data.get("total"))
+            self.tax[row] = _to_float(data.get("totalTax"))
+            self.created[row] = created.timestamp() if hasattr(created, "timestamp") else np.nan
+            self.is_open[row] = status in OPEN_STATUSES
+            self.live[row] = True
+            self.buyer[row] = self._code(self.buyer_keys, buyer_key, buyer_name)
+            self.seller[row] = self._code(self.seller_keys, data.get("sellerId") or "")
+
+    def remove(self, invoice_id):
+        with self._lock:
+            row = self.row_of.get(invoice_id)
+            if row is not None:
+                self.live[row] = False
+
+    # ===== Queries =====
+    def summary(self, top=5, seller_id=None, now=None, include_customers=False):
+        """Outstanding totals, aging and the ``top`` debtors; with
+        ``include_customers`` also every owing customer's balance."""
+        now = now or time.time()
+        with self._lock:
+            n = self.size
+            mask = self.live[:n] & self.is_open[:n]
+            if seller_id is not None:
+                code = self.seller_keys.get(seller_id)
+                mask &= (self.seller[:n] == code) if code is not None else False
+
+            total = self.total[:n][mask]
+            tax = self.tax[:n][mask]
+            buyer = self.buyer[:n][mask]
+            age_days = (now - self.created[:n][mask]) / 86400.0
+            buyer_names = list(self.buyer_names)
+            n_buyers = len(self.buyer_keys)
+
+        known = ~np.isnan(age_days)
+        bucket = np.digitize(age_days[known], AGING_EDGES, right=True)
+        aging = np.bincount(bucket, weights=total[known], minlength=len(AGING_LABELS))
+        aging_counts = np.bincount(bucket, minlength=len(AGING_LABELS))
+
+        per_buyer = np.bincount(buyer, weights=total, minlength=n_buyers)
+        per_buyer_count = np.bincount(buyer, minlength=n_buyers)
+        owing = np.flatnonzero(per_buyer > 0)
+        k = min(max(int(top), 0), len(owing))
+        if k:
+            top_idx = owing[np.argpartition(-per_buyer[owing], k - 1)[:k]]
+            top_idx = top_idx[np.argsort(-per_buyer[top_idx])]
+        else:
+            top_idx = []
+
+        result = {
+            "outstanding_total": round(float(total.sum()), 2),
+            "outstanding_tax": round(float(tax.sum()), 2),
+            "open_invoices": int(mask.sum()),
+            "customers_owing": int(len(owing)),
+            "aging": [
+                {"bucket": label, "amount": round(float(amount), 2), "invoices": int(count)}
+                for label, amount, count in zip(AGING_LABELS, aging, aging_counts)
+            ] + [{
+                "bucket": UNKNOWN_AGE_LABEL,
+                "amount": round(float(total[~known].sum()), 2),
+                "invoices": int((~known).sum()),
+            }],
+            "top_debtors": [_customer_row(buyer_names, per_buyer, per_buyer_count, i) for i in top_idx],
+        }
+        if include_customers:
+            ordered = owing[np.argsort(-per_buyer[owing], kind="stable")]
+            result["customers"] = [_customer_row(buyer_names, per_buyer, per_buyer_count, i) for i in ordered]
+        return result
+
+
+def _customer_row(buyer_names, per_buyer, per_buyer_count, i):
+    return {"customer": buyer_names[i], "outstanding": round(float(per_buyer[i]), 2),
+            "invoices": int(per_buyer_count[i])}
+
+
+def _to_float(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# ===== Live snapshot =====
+_snapshot = None
+_watch = None
+_ready = threading.Event()
+_snapshot_lock = threading.Lock()
+
+
+def _on_invoices_snapshot(col_snapshot, changes, read_time):
+    for change in changes:
+        if change.type.name == "REMOVED":
+            _snapshot.remove(change.document.id)
+        else:
+            _snapshot.upsert(change.document.id, change.document.to_dict())
+    _ready.set()
+
+
+def get_snapshot(wait_seconds=FIRST_LOAD_WAIT_SECONDS):
+    """Process-wide snapshot. The first call loads the collection once and then
+    follows changes through a Firestore listener instead of re-reading it.
+
+    Only the call that starts the listener waits for the initial load; any
+    call made while it has not arrived raises SnapshotNotReady at once, so a
+    stalled or failed listener cannot block every request.
+    """
+    global _snapshot, _watch
+    started = False
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = ReceivablesSnapshot()
+            _watch = db.collection("invoices").on_snapshot(_on_invoices_snapshot)
+            started = True
+            logging.info("Started receivables snapshot listener")
+    if started:
+        _ready.wait(wait_seconds)
+    if not _ready.is_set():
+        raise SnapshotNotReady("receivables snapshot is not loaded yet")
+    return _snapshot
+
+
+def receivables_summary(top=5, seller_id=None, include_customers=False):
+    return get_snapshot().summary(top=top, seller_id=seller_id, include_customers=include_customers)
@@ -0,0 +1,196 @@
+# reconcile_payments.py
+# Incremental payment reconciliation: pages through Razorpay payments created
+# since the last run, matches them to invoices (notes, description, or the
+# reminder.linkId of the payment link they were made through) and marks those
+# invoices paid in batched Firestore writes.
+import json
+import logging
+import os
+import re
+import time
+
+from firebase_admin import firestore
+
+from firebase_utils import db
+from reminder_service import client, razorpay_breaker, FIRESTORE_BATCH_LIMIT, RAZORPAY_TIMEOUT
+
+# ===== CONFIG =====
+CHECKPOINT_FILE = os.getenv("RECONCILE_CHECKPOINT_FILE", "reconcile_checkpoint.json")
+PAGE_SIZE = 100  # Razorpay maximum for list endpoints
+# Payments are filtered by created_at, but may be captured some time after they
+# were created; each run re-scans this window before the previous run's end so
+# late captures are not missed. Payments already handled are skipped.
+LOOKBACK_SECONDS = 60 * 60
+# First run without a checkpoint only looks this far back
+INITIAL_WINDOW_SECONDS = 30 * 24 * 60 * 60
+
+# Exactly the descriptions reminder_service writes: "Invoice #<id>" for single
+# reminders, "Invoices #<id>, #<id>" for digests
+DESCRIPTION_RE = re.compile(r"^Invoices? #[^\s,]+(?:, #[^\s,]+)*$")
+INVOICE_REF_RE = re.compile(r"#([^\s,]+)")
+
+
+# ===== Checkpoint =====
+def load_checkpoint():
+    if os.path.exists(CHECKPOINT_FILE):
+        with open(CHECKPOINT_FILE, "r") as f:
+            return json.load(f)
+    return {}
+
+
+def save_checkpoint(data):
+    tmp = CHECKPOINT_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp, CHECKPOINT_FILE)
+
+
+# ===== Razorpay paging =====
+def iter_captured_payments(since, until):
+    """Yield captured payments with since <= created_at <= until, one page at a time.
+
+    Each page goes through the shared Razorpay breaker with a timeout, so a hung
+    or failing Razorpay fails the run fast instead of stalling the scheduler.
+    """
+    skip = 0
+    while True:
+        page = razorpay_breaker.call(client.payment.all,
+                                     {"from": since, "to": until, "count": PAGE_SIZE, "skip": skip},
+                                     timeout=RAZORPAY_TIMEOUT)
+        items = page.get("items", [])
+        for payment in items:
+            if payment.get("status") == "captured":
+                yield payment
+        if len(items) < PAGE_SIZE:
+            return
+        skip += PAGE_SIZE
+
+
+def is_document_id(invoice_id):
+    """Ids usable with collection("invoices").document(): no "/", not "." or
+    "..", not reserved (__x__) and at most 1500 bytes."""
+    return (bool(invoice_id) and "/" not in invoice_id and invoice_id not in (".", "..")
+            and not (invoice_id.startswith("__") and invoice_id.endswith("__"))
+            and len(invoice_id.encode("utf-8")) <= 1500)
+
+
+def match_invoice_ids(payment):
+    """Invoice ids from the payment notes (set on links we create) or its description.
+
+    Digest links cover several invoices, listed in invoice_ids_N notes. Ids
+    that cannot be Firestore document ids (e.g. "N/A") are dropped.
+    """
+    ids = []
+    notes = payment.get("notes") or {}
+    if isinstance(notes, dict):
+        if notes.get("invoice_id"):
+            ids = [str(notes["invoice_id"])]
+        else:
+            ids = [invoice_id for key in sorted(notes) if key.startswith("invoice_ids_")
+                   for invoice_id in str(notes[key]).split(",") if invoice_id]
+    if not ids:
+        description = payment.get("description") or ""
+        if DESCRIPTION_RE.match(description):
+            ids = INVOICE_REF_RE.findall(description)
+    return [invoice_id for invoice_id in ids if is_document_id(invoice_id)]
+
+
+def match_invoice_ids_by_link(payment):
+    """Invoice ids whose reminder.linkId is the payment link this payment was made through.
+
+    Fallback for payments that do not carry our notes or description; costs one
+    Razorpay lookup and one Firestore query per such payment. Errors are logged
+    and None is returned, so one bad payment cannot stall the run.
+    """
+    try:
+        links = razorpay_breaker.call(client.payment_link.all, {"payment_id": payment.get("id")},
+                                      timeout=RAZORPAY_TIMEOUT)
+        ids = []
+        for link in links.get("payment_links", []):
+            query = db.collection("invoices").where("reminder.linkId", "==", link.get("id"))
+            ids.extend(doc.id for doc in query.select([]).stream())
+        return ids
+    except Exception:
+        logging.exception("Link lookup for payment %s failed", payment.get("id"))
+        return None
+
+
+# ===== Reconcile =====
+def reconcile_payments():
+    """Run one incremental reconciliation pass. Returns the number of invoices marked paid."""
+    if client is None:
+        logging.error("[Reconcile ERROR] Razorpay client not initialized")
+        return 0
+
+    checkpoint = load_checkpoint()
+    until = int(time.time())
+    # "last_created_at" is the cursor written by earlier versions of this job
+    last_until = checkpoint.get("last_until", checkpoint.get("last_created_at", until - INITIAL_WINDOW_SECONDS))
+    since = last_until - LOOKBACK_SECONDS
+    # Payments handled by earlier runs that are still inside the lookback window
+    seen = {pid: created for pid, created in checkpoint.get("seen", {}).items() if created >= since}
+
+    matched = {}
+    scanned = 0
+    for payment in iter_captured_payments(since, until):
+        if payment.get("id") in seen:
+            continue
+        scanned += 1
+        invoice_ids = match_invoice_ids(payment) or match_invoice_ids_by_link(payment)
+        if invoice_ids is None:
+            # Lookup failed: not marked seen, so runs within the lookback window retry it
+            continue
+        for invoice_id in invoice_ids:
+            matched[invoice_id] = payment
+        seen[payment.get("id")] = payment.get("created_at", until)
+
+    updated, complete = _mark_invoices_paid(matched)
+
+    # Only move the window forward once every match has been written; the next
+    # run then starts at this run's end, so a run costs O(new payments)
+    if complete:
+        checkpoint.pop("last_created_at", None)
+        checkpoint["last_until"] = until
+        checkpoint["seen"] = seen
+        checkpoint["last_run_at"] = until
+        save_checkpoint(checkpoint)
+    logging.info("==== Reconcile: scanned %d new payments, matched %d, marked paid %d ====", scanned, len(matched), updated)
+    return updated
+
+
+def _mark_invoices_paid(matched):
+    if not matched:
+        return 0, True
+
+    # One batched read to drop ids that are not invoices or are already paid
+    refs = [db.collection("invoices").document(invoice_id) for invoice_id in matched]
+    to_update = []
+    for snap in db.get_all(refs):
+        if snap.exists and (snap.to_dict() or {}).get("status") != "paid":
+            to_update.append(snap.id)
+
+    updated = 0
+    for i in range(0, len(to_update), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        chunk = to_update[i:i + FIRESTORE_BATCH_LIMIT]
+        for invoice_id in chunk:
+            payment = matched[invoice_id]
+            batch.update(db.collection("invoices").document(invoice_id), {
+                "status": "paid",
+                "buyerInfo.status": "paid",
+                "payment.razorpayPaymentId": payment.get("id"),
+                "payment.amount": payment.get("amount", 0) / 100,
+                "payment.paidAt": firestore.SERVER_TIMESTAMP,
+            })
+        try:
+            batch.commit()
+            updated += len(chunk)
+        except Exception:
+            logging.exception("Failed to commit reconcile batch")
+            return updated, False
+    return updated, True
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    reconcile_payments()
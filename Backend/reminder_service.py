@@ -0,0 +1,281 @@
+# reminder_service.py
+# Single implementation of payment reminders, shared by the chatbot tool
+# (agent2) and the reminder scheduler (agent3).
+import logging
+import os
+import time
+
+import razorpay
+from dotenv import load_dotenv
+from firebase_admin import firestore
+
+import audit_log
+from firebase_utils import db
+from resilience import get_breaker, guarded_post
+
+load_dotenv()
+
+# ===== CONFIG =====
+RAZORPAY_KEY = os.getenv("RAZORPAY_KEY_ID")
+RAZORPAY_SECRET = os.getenv("RAZORPAY_KEY_SECRET")
+ULTRAMSG_TOKEN = os.getenv("ULTRAMSG_TOKEN")
+ULTRAMSG_INSTANCE = os.getenv("ULTRAMSG_INSTANCE")
+SERVER_BASE_URL = os.getenv("SERVER_BASE_URL", "https://your-server.com")
+
+# Firestore rejects batches with more than 500 writes
+FIRESTORE_BATCH_LIMIT = 500
+
+RAZORPAY_TIMEOUT = 10
+ULTRAMSG_TIMEOUT = 10
+
+# Razorpay notes: at most 15 keys of up to 256 characters each
+NOTE_VALUE_LIMIT = 256
+MAX_INVOICES_PER_DIGEST = 50
+
+# Razorpay client - initialize with error handling
+try:
+    if not RAZORPAY_KEY or not RAZORPAY_SECRET:
+        raise ValueError("Razorpay credentials missing in environment")
+    client = razorpay.Client(auth=(RAZORPAY_KEY, RAZORPAY_SECRET))
+    logging.info("Razorpay client initialized successfully (reminder_service)")
+except Exception as e:
+    logging.error("Failed to initialize Razorpay client (reminder_service): %s", e)
+    client = None
+
+razorpay_breaker = get_breaker("razorpay", excluded=(razorpay.errors.BadRequestError,))
+
+
+def ultramsg_chat_endpoint():
+    return f"https://api.ultramsg.com/{ULTRAMSG_INSTANCE}/messages/chat"
+
+
+# ===== Phone =====
+def normalize_phone(raw_phone):
+    """Return the contact as +91XXXXXXXXXX, or None if it is not a valid Indian number."""
+    digits = "".join(filter(str.isdigit, str(raw_phone or "").strip()))
+    if len(digits) == 10:
+        digits = "91" + digits
+    elif len(digits) == 12 and digits.startswith("91"):
+        pass
+    else:
+        return None
+    return "+" + digits
+
+
+# ===== Firestore write-back =====
+class ReminderWriteBack:
+    """Collects reminder state updates and commits them as Firestore batches.
+
+    The scheduler creates one per cycle and calls commit() once at the end, so
+    N reminders cost ceil(N / 500) round trips instead of N.
+    """
+
+    def __init__(self):
+        self.updates = {}
+
+    def record(self, invoice_id, link_id=None):
+        self.updates[invoice_id] = {
+            "reminder.lastRemindedAt": firestore.SERVER_TIMESTAMP,
+            "reminder.count": firestore.Increment(1),
+            "reminder.linkId": link_id,
+        }
+
+    def commit(self):
+        if not self.updates:
+            return 0
+
+        items = list(self.updates.items())
+        committed = 0
+        for i in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+            batch = db.batch()
+            for invoice_id, fields in items[i:i + FIRESTORE_BATCH_LIMIT]:
+                batch.update(db.collection("invoices").document(invoice_id), fields)
+            try:
+                batch.commit()
+                committed += len(items[i:i + FIRESTORE_BATCH_LIMIT])
+            except Exception:
+                logging.exception("Failed to commit reminder write-back batch")
+
+        logging.info("Reminder write-back committed for %d/%d invoices", committed, len(items))
+        self.updates = {}
+        return committed
+
+
+# ===== Send Reminder =====
+def send_reminder(invoice_data, invoice_id=None, write_back=None):
+    """Create a Razorpay link for the invoice total and send it over WhatsApp.
+
+    On success the reminder state is recorded on the invoice document: queued
+    on ``write_back`` when given (batched by the caller), otherwise written
+    immediately. Returns True if UltraMsg accepted the message.
+    """
+    start = time.perf_counter()
+    try:
+        logging.info("Sending reminder for invoice: %s", invoice_id)
+        logging.debug("invoice_data: %s", invoice_data)
+
+        phone = normalize_phone(invoice_data.get("buyerInfo", {}).get("contact"))
+        if phone is None:
+            logging.error("[PHONE ERROR] Invalid phone number for invoice %s", invoice_id)
+            _audit_reminder(invoice_id, start, "invalid_phone")
+            return False
+
+        if client is None:
+            logging.error("[Reminder ERROR] Razorpay client not initialized. Check RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET in .env")
+            _audit_reminder(invoice_id, start, "no_razorpay_client")
+            return False
+
+        invoice_number = invoice_id or "N/A"
+        amount_in_paise = int(float(invoice_data["total"]) * 100)
+
+        payment = razorpay_breaker.call(client.payment_link.create, {
+            "amount": amount_in_paise,
+            "currency": "INR",
+            "description": f"Invoice #{invoice_number}",
+            "customer": {"contact": phone},
+            "notify": {"sms": True, "email": False},
+            "notes": {"invoice_id": invoice_number},
+            "callback_url": f"{SERVER_BASE_URL}/payment-success/{invoice_number}",
+            "callback_method": "get"
+        }, timeout=RAZORPAY_TIMEOUT)
+        link_id = payment.get("id")
+        payment_url = payment.get("short_url")
+        logging.debug("[DEBUG] Razorpay Link: %s", payment_url)
+
+        msg = (
+            f"⚠️ Payment Reminder\n"
+            f"Invoice #{invoice_number}\n"
+            f"Amount: ₹{invoice_data['total']}\n"
+            f"Pay now: {payment_url}"
+        )
+
+        response = _post_whatsapp(phone, msg)
+        if response.status_code != 200 or "error" in response.text.lower():
+            _audit_reminder(invoice_id, start, "ultramsg_error", http_status=response.status_code)
+            return False
+
+        if invoice_id:
+            _record_reminder(invoice_id, link_id, write_back)
+        _audit_reminder(invoice_id, start, "sent", link_id=link_id)
+        return True
+
+    except Exception as e:
+        logging.error("[Reminder ERROR] %s", e)
+        _audit_reminder(invoice_id, start, "error", error=type(e).__name__)
+        return False
+
+
+def send_digest_reminder(invoices, write_back=None):
+    """One WhatsApp digest and one combined Razorpay link for a customer's open invoices.
+
+    ``invoices`` is a list of (invoice_id, invoice_data) that share a buyer
+    contact. Every invoice in the digest gets the same reminder.linkId.
+    Returns True if UltraMsg accepted the message.
+    """
+    start = time.perf_counter()
+    invoice_ids = [invoice_id for invoice_id, _ in invoices]
+    try:
+        logging.info("Sending digest reminder for %d invoices: %s", len(invoice_ids), invoice_ids)
+
+        phone = normalize_phone(invoices[0][1].get("buyerInfo", {}).get("contact"))
+        if phone is None:
+            logging.error("[PHONE ERROR] Invalid phone number for invoices %s", invoice_ids)
+            _audit_digest(invoice_ids, start, "invalid_phone")
+            return False
+
+        if client is None:
+            logging.error("[Reminder ERROR] Razorpay client not initialized. Check RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET in .env")
+            _audit_digest(invoice_ids, start, "no_razorpay_client")
+            return False
+
+        totals = [float(data.get("total") or 0) for _, data in invoices]
+        amount_in_paise = int(round(sum(totals) * 100))
+
+        payment = razorpay_breaker.call(client.payment_link.create, {
+            "amount": amount_in_paise,
+            "currency": "INR",
+            "description": "Invoices " + ", ".join(f"#{invoice_id}" for invoice_id in invoice_ids),
+            "customer": {"contact": phone},
+            "notify": {"sms": True, "email": False},
+            "notes": digest_notes(invoice_ids),
+            "callback_url": f"{SERVER_BASE_URL}/payment-success/{invoice_ids[0]}",
+            "callback_method": "get"
+        }, timeout=RAZORPAY_TIMEOUT)
+        link_id = payment.get("id")
+        payment_url = payment.get("short_url")
+
+        lines = "\n".join(f"• Invoice #{invoice_id}: ₹{total:.2f}" for invoice_id, total in zip(invoice_ids, totals))
+        msg = (
+            f"⚠️ Payment Reminder\n"
+            f"You have {len(invoice_ids)} unpaid invoices:\n"
+            f"{lines}\n"
+            f"Total due: ₹{sum(totals):.2f}\n"
+            f"Pay all now: {payment_url}"
+        )
+
+        response = _post_whatsapp(phone, msg)
+        if response.status_code != 200 or "error" in response.text.lower():
+            _audit_digest(invoice_ids, start, "ultramsg_error", http_status=response.status_code)
+            return False
+
+        for invoice_id in invoice_ids:
+            _record_reminder(invoice_id, link_id, write_back)
+        _audit_digest(invoice_ids, start, "sent", link_id=link_id)
+        return True
+
+    except Exception as e:
+        logging.error("[Reminder ERROR] %s", e)
+        _audit_digest(invoice_ids, start, "error", error=type(e).__name__)
+        return False
+
+
+def digest_notes(invoice_ids):
+    """Spread invoice ids over Razorpay notes (max 15 keys, 256 chars per value)."""
+    notes = {}
+    chunk = []
+    for invoice_id in invoice_ids:
+        if chunk and len(",".join(chunk + [invoice_id])) > NOTE_VALUE_LIMIT:
+            notes[f"invoice_ids_{len(notes) + 1}"] = ",".join(chunk)
+            chunk = []
+        chunk.append(invoice_id)
+    if chunk:
+        notes[f"invoice_ids_{len(notes) + 1}"] = ",".join(chunk)
+    return notes
+
+
+def _post_whatsapp(phone, msg):
+    payload = {
+        "token": ULTRAMSG_TOKEN,
+        "to": phone,
+        "body": msg,
+        "priority": "10"
+    }
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    response = guarded_post("ultramsg", ultramsg_chat_endpoint(), ULTRAMSG_TIMEOUT, data=payload, headers=headers)
+
+    logging.info("[UltraMsg] Status: %s", response.status_code)
+    if response.status_code != 200 or "error" in response.text.lower():
+        logging.error("[UltraMsg ERROR] %s", response.text)
+    return response
+
+
+def _record_reminder(invoice_id, link_id, write_back):
+    if write_back is not None:
+        write_back.record(invoice_id, link_id)
+        return
+
+    single = ReminderWriteBack()
+    single.record(invoice_id, link_id)
+    single.commit()
+
+
+def _audit_reminder(invoice_id, start, outcome, **fields):
+    duration_ms = round((time.perf_counter() - start) * 1000, 2)
+    audit_log.emit("send_reminder", invoice_id=invoice_id, outcome=outcome, duration_ms=duration_ms, **fields)
+
+
+def _audit_digest(invoice_ids, start, outcome, **fields):
+    duration_ms = round((time.perf_counter() - start) * 1000, 2)
+    for invoice_id in invoice_ids:
+        audit_log.emit("send_digest_reminder", invoice_id=invoice_id, outcome=outcome,
+                       duration_ms=duration_ms, digest_size=len(invoice_ids), **fields)
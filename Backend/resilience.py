@@ -0,0 +1,166 @@
+# resilience.py
+# Circuit breakers and deadline budgets for outbound provider calls
+# (Razorpay, Cloudinary, UltraMsg), shared by all agents.
+import logging
+import os
+import threading
+import time
+
+import requests
+
+# ===== CONFIG =====
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", 30))
+INVOICE_DEADLINE_SECONDS = float(os.getenv("INVOICE_DEADLINE_SECONDS", 60))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the provider while its breaker is open."""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the request's deadline budget is used up."""
+
+
+class ProviderUnavailable(Exception):
+    """Raised for provider 5xx responses so they count as breaker failures."""
+
+
+# ===== Circuit breaker =====
+class CircuitBreaker:
+    """Per-provider breaker.
+
+    closed    -> calls go through; consecutive failures are counted.
+    open      -> calls fail immediately with CircuitOpenError until reset_seconds pass.
+    half_open -> one trial call is let through; success closes, failure re-opens.
+
+    Exceptions listed in ``excluded`` (e.g. 4xx validation errors) are the
+    caller's fault and do not count as provider failures.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds=BREAKER_RESET_SECONDS, excluded=()):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.excluded = tuple(excluded)
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logging.info("Circuit %s closed", self.name)
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logging.warning("Circuit %s opened after %d failures", self.name, self.failures)
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def call(self, fn, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        try:
+            result = fn(*args, **kwargs)
+        except self.excluded:
+            self.record_success()
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self.state, "failures": self.failures}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name, **kwargs):
+    """Return the process-wide breaker for a provider, creating it on first use."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, **kwargs)
+        return _breakers[name]
+
+
+def breaker_states():
+    with _breakers_lock:
+        return {name: b.snapshot() for name, b in _breakers.items()}
+
+
+# ===== Deadline budget =====
+class Deadline:
+    """Absolute wall-clock deadline for one request.
+
+    Stored in graph state as a plain epoch timestamp (``deadline_at``) so it
+    survives LangGraph state copies and JSON serialization.
+    """
+
+    def __init__(self, deadline_at):
+        self.deadline_at = deadline_at
+
+    @classmethod
+    def after(cls, seconds=INVOICE_DEADLINE_SECONDS):
+        return cls(time.time() + seconds)
+
+    @classmethod
+    def from_state(cls, state):
+        deadline_at = state.get("deadline_at")
+        if deadline_at is None:
+            return cls.after()
+        return cls(deadline_at)
+
+    def remaining(self):
+        return self.deadline_at - time.time()
+
+    def timeout(self, cap):
+        """Per-call timeout: the smaller of ``cap`` and what is left of the budget."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("request deadline exceeded")
+        return min(cap, remaining)
+
+
+# ===== Guarded HTTP =====
+def guarded_post(provider, url, timeout, **kwargs):
+    """requests.post through the provider's breaker; 5xx responses count as failures."""
+    def _post():
+        r = requests.post(url, timeout=timeout, **kwargs)
+        if r.status_code >= 500:
+            raise ProviderUnavailable(f"{provider} returned {r.status_code}")
+        return r
+
+    return get_breaker(provider).call(_post)
+
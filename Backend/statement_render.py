@@ -0,0 +1,117 @@
+# statement_render.py
+# HTML and PDF rendering of consolidated customer statements. Kept free of
+# Firestore imports so tools/bench_statement.py can run on synthetic invoices
+# without credentials.
+import html
+import os
+import tempfile
+from datetime import datetime
+
+import pdfkit
+
+import pdf_store
+
+STATEMENT_CSS = """
+body { font-family: Arial, sans-serif; padding: 20px; font-size: 12px; }
+h1 { border-bottom: 1px solid #ddd; padding-bottom: 10px; }
+h2 { margin-top: 24px; font-size: 15px; }
+table { width: 100%; border-collapse: collapse; page-break-inside: auto; }
+tr { page-break-inside: avoid; }
+th, td { border-bottom: 1px solid #eee; padding: 4px 6px; text-align: left; }
+td.num, th.num { text-align: right; }
+.invoice-total { font-weight: bold; }
+.grand-total { font-size: 18px; font-weight: bold; margin-top: 24px; }
+"""
+
+
+# ===== HTML =====
+def _money(value):
+    try:
+        return f"₹{float(value):,.2f}"
+    except (TypeError, ValueError):
+        return "₹0.00"
+
+
+def format_date(value):
+    if hasattr(value, "strftime"):
+        return value.strftime("%Y-%m-%d")
+    return html.escape(str(value or ""))
+
+
+def render_invoice_section(invoice_id, data):
+    """HTML for one invoice: header, item rows and totals."""
+    rows = []
+    for item in data.get("items", []):
+        rows.append(
+            "<tr>"
+            f"<td>{html.escape(str(item.get('name', '')))}</td>"
+            f"<td class=\"num\">{item.get('quantity', 0)}</td>"
+            f"<td class=\"num\">{_money(item.get('unitPrice'))}</td>"
+            f"<td class=\"num\">{_money(item.get('taxAmount'))}</td>"
+            f"<td class=\"num\">{_money(item.get('lineTotal'))}</td>"
+            "</tr>"
+        )
+    status = data.get("status") or data.get("buyerInfo", {}).get("status", "")
+    return (
+        f"<h2>Invoice #{html.escape(invoice_id)} &middot; {format_date(data.get('createdAt'))} "
+        f"&middot; {html.escape(str(status))}</h2>"
+        "<table><tr><th>Item</th><th class=\"num\">Qty</th><th class=\"num\">Unit price</th>"
+        "<th class=\"num\">Tax</th><th class=\"num\">Line total</th></tr>"
+        + "".join(rows)
+        + f"<tr class=\"invoice-total\"><td colspan=\"4\">Total</td><td class=\"num\">{_money(data.get('total'))}</td></tr>"
+        "</table>"
+    )
+
+
+def iter_statement_html(invoices, title):
+    """Yield the statement document in chunks; ``invoices`` may be any iterator."""
+    yield (
+        "<html><head><meta charset=\"utf-8\"/>"
+        f"<style>{STATEMENT_CSS}</style></head><body>"
+        f"<h1>{html.escape(title)}</h1>"
+    )
+    count = 0
+    grand_total = 0.0
+    outstanding = 0.0
+    for invoice_id, data in invoices:
+        count += 1
+        total = float(data.get("total") or 0)
+        grand_total += total
+        if (data.get("status") or data.get("buyerInfo", {}).get("status")) != "paid":
+            outstanding += total
+        yield render_invoice_section(invoice_id, data)
+
+    yield (
+        f"<div class=\"grand-total\">Invoices: {count} &middot; Total billed: {_money(grand_total)} "
+        f"&middot; Outstanding: {_money(outstanding)}</div>"
+        f"<p>Generated {datetime.now().strftime('%Y-%m-%d %H:%M')}</p>"
+        "</body></html>"
+    )
+
+
+# ===== Render =====
+def render_statement_pdf(invoices, title):
+    """Render one PDF for all ``invoices`` and return (digest, invoice_count)."""
+    os.makedirs(pdf_store.PDF_STORE_DIR, exist_ok=True)
+    count = 0
+
+    def counted():
+        nonlocal count
+        for item in invoices:
+            count += 1
+            yield item
+
+    # Temp files live inside the store directory so the final move is a rename
+    with tempfile.NamedTemporaryFile("w", suffix=".html", dir=pdf_store.PDF_STORE_DIR,
+                                     encoding="utf-8", delete=False) as f:
+        html_path = f.name
+        for chunk in iter_statement_html(counted(), title):
+            f.write(chunk)
+
+    pdf_path = html_path[:-len(".html")] + ".pdf"
+    try:
+        pdfkit.from_file(html_path, pdf_path, options={"quiet": ""})
+    finally:
+        os.remove(html_path)
+
+    return pdf_store.put_file(pdf_path), count
@@ -0,0 +1,80 @@
+# statements.py
+# Consolidated customer statements: all of a customer's invoices in one PDF,
+# rendered by a single wkhtmltopdf pass and uploaded once.
+#
+# Invoices are streamed from Firestore and the HTML is written to a temp file
+# chunk by chunk, so Python memory stays bounded by one invoice at a time no
+# matter how many line items the customer has.
+import logging
+from datetime import timedelta
+
+import pdf_store
+from firebase_utils import db
+from reminder_service import normalize_phone
+from statement_render import render_statement_pdf, format_date
+
+
+# ===== Firestore =====
+def contact_variants(contact):
+    """Stored spellings of one phone number: +919876543210, 919876543210,
+    9876543210 and +91 9876543210. Input that is not a valid Indian number
+    is matched exactly."""
+    raw = str(contact).strip()
+    phone = normalize_phone(raw)
+    if phone is None:
+        return [raw]
+    national = phone[3:]
+    variants = [phone, phone[1:], national, f"+91 {national}"]
+    if raw not in variants:
+        variants.append(raw)
+    return variants
+
+
+def iter_customer_invoices(contact=None, customer_name=None, seller_id=None, start=None, end=None):
+    """Yield (invoice_id, data) for a customer's invoices in createdAt order.
+
+    ``contact`` is normalized like the reminders do and matched against the
+    formats it is stored in (see contact_variants) with an indexed ``in``
+    filter; ``customer_name`` is matched case-insensitively client-side like
+    get_customer_info does.
+    """
+    query = db.collection("invoices")
+    if contact:
+        query = query.where("buyerInfo.contact", "in", contact_variants(contact))
+    if seller_id:
+        query = query.where("sellerId", "==", seller_id)
+    if start:
+        query = query.where("createdAt", ">=", start)
+    if end:
+        query = query.where("createdAt", "<", end)
+    query = query.order_by("createdAt")
+
+    name = customer_name.strip().lower() if customer_name else None
+    for doc in query.stream():
+        data = doc.to_dict()
+        if name and data.get("buyerInfo", {}).get("name", "").strip().lower() != name:
+            continue
+        yield doc.id, data
+
+
+def create_statement(contact=None, customer_name=None, seller_id=None, start=None, end=None):
+    """Build, store and schedule the upload of a customer statement."""
+    label = customer_name or contact or "customer"
+    title = f"Statement for {label}"
+    if start or end:
+        # ``end`` is exclusive; an end at midnight is shown as the day before it
+        last_day = end
+        if end is not None and hasattr(end, "hour") and (end.hour, end.minute, end.second, end.microsecond) == (0, 0, 0, 0):
+            last_day = end - timedelta(days=1)
+        title += f" ({format_date(start) or '...'} to {format_date(last_day) or '...'})"
+
+    invoices = iter_customer_invoices(contact, customer_name, seller_id, start, end)
+    digest, count = render_statement_pdf(invoices, title)
+    pdf_store.schedule_upload(digest, f"statements/statement_{digest[:16]}")
+    logging.info("Rendered statement for %s with %d invoices as %s", label, count, digest)
+
+    return {
+        "invoice_count": count,
+        "pdf_digest": digest,
+        "pdf_url": pdf_store.local_url(digest),
+    }
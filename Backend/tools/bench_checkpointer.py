@@ -0,0 +1,69 @@
+"""Benchmark: per-turn latency of the chatbot graph with SqliteCheckpointer vs MemorySaver.
+
+Uses an echo node instead of the LLM so only checkpoint read/write cost is measured.
+Each reply is ``chars`` long so a long thread has a realistic history size.
+Run from Backend/:  python tools/bench_checkpointer.py [turns] [chars]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from typing_extensions import TypedDict, Annotated
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import StateGraph, START, END
+from langgraph.graph.message import add_messages
+
+from chat_checkpointer import SqliteCheckpointer
+
+turns = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+chars = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+
+class InputState(TypedDict):
+    messages: Annotated[list, add_messages]
+    tool_input: dict
+
+
+def echo_node(state: InputState):
+    return {"messages": [AIMessage(content="x" * chars)]}
+
+
+def build(checkpointer):
+    graph = StateGraph(InputState)
+    graph.add_node("chat_node", echo_node)
+    graph.add_edge(START, "chat_node")
+    graph.add_edge("chat_node", END)
+    return graph.compile(checkpointer=checkpointer)
+
+
+def run(name, checkpointer, db_path=None):
+    bot = build(checkpointer)
+    config = {"configurable": {"thread_id": "bench"}}
+    latencies = []
+    for i in range(turns):
+        start = time.perf_counter()
+        bot.invoke({"messages": [HumanMessage(content=f"message {i}")], "tool_input": {}}, config=config)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    checkpointer.get_tuple(config)
+    read_ms = (time.perf_counter() - start) * 1000
+    latencies.sort()
+    print(f"{name:>8}: turn p50 {statistics.median(latencies):.2f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.2f} ms, "
+          f"max {latencies[-1]:.2f} ms, read latest {read_ms:.2f} ms")
+    if db_path:
+        size = sum(os.path.getsize(p) for p in (db_path, db_path + "-wal") if os.path.exists(p))
+        print(f"{'':>8}  database {size / 1024 / 1024:.1f} MiB after {turns} turns")
+
+
+print(f"{turns} turns, {chars}-char replies")
+run("memory", MemorySaver())
+with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, "bench.db")
+    run("sqlite", SqliteCheckpointer(path), path)
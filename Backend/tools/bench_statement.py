@@ -0,0 +1,57 @@
+"""Benchmark: one consolidated statement PDF vs. one PDF per invoice.
+
+Uses synthetic invoices and imports only statement_render, so it needs neither
+Firestore nor credentials. Needs wkhtmltopdf.
+Run from Backend/:  python tools/bench_statement.py [invoices] [items_per_invoice]
+"""
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdfkit
+import statement_render
+
+n_invoices = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+n_items = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+
+def synthetic_invoices():
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for i in range(n_invoices):
+        items = [{
+            "name": f"Product {j}",
+            "quantity": 1 + j % 3,
+            "unitPrice": 100.0 + j,
+            "taxAmount": 18.0,
+            "lineTotal": 118.0 + j,
+        } for j in range(n_items)]
+        yield f"INV{i:05d}", {
+            "createdAt": base + timedelta(days=i),
+            "status": "pending" if i % 2 else "paid",
+            "total": sum(item["lineTotal"] for item in items),
+            "items": items,
+        }
+
+
+print(f"{n_invoices} invoices x {n_items} items")
+
+start = time.perf_counter()
+for invoice_id, data in synthetic_invoices():
+    doc = "".join(statement_render.iter_statement_html(iter([(invoice_id, data)]), f"Invoice {invoice_id}"))
+    pdfkit.from_string(doc, False, options={"quiet": ""})
+per_invoice = time.perf_counter() - start
+print(f"per-invoice renders: {per_invoice:.2f}s ({n_invoices / per_invoice:.1f} invoices/s)")
+
+tracemalloc.start()
+start = time.perf_counter()
+digest, count = statement_render.render_statement_pdf(synthetic_invoices(), "Benchmark statement")
+single_pass = time.perf_counter() - start
+_, peak = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+print(f"single-pass statement: {single_pass:.2f}s ({count / single_pass:.1f} invoices/s), "
+      f"python peak {peak / 1024:.0f} KiB")
+print(f"speedup: {per_invoice / single_pass:.1f}x")
@@ -0,0 +1,251 @@
+# whatsapp_outbox.py
+# Durable outbox for outbound WhatsApp messages. Callers insert a row into a
+# local SQLite queue and return immediately; a small pool of sender threads
+# drains it through UltraMsg with retries, dedup keys and rate limiting.
+#
+# The database is shared by every worker process on the host, so both the
+# claim of a message and the rate limit go through SQLite: OUTBOX_RATE_PER_SEC
+# is the UltraMsg rate for the whole host, not per process.
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from resilience import CircuitOpenError, guarded_post
+
+load_dotenv()
+
+# ===== CONFIG =====
+ULTRAMSG_TOKEN = os.getenv("ULTRAMSG_TOKEN")
+ULTRAMSG_INSTANCE = os.getenv("ULTRAMSG_INSTANCE")
+OUTBOX_DB = os.getenv("OUTBOX_DB", os.path.join(os.getcwd(), "outbox.db"))
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", 2))
+OUTBOX_RATE_PER_SEC = float(os.getenv("OUTBOX_RATE_PER_SEC", 1.0))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 6))
+OUTBOX_POLL_SECONDS = 1.0
+ULTRAMSG_TIMEOUT = 10
+# A 'sending' row not touched for this long belongs to a sender that died and is
+# claimed again; live senders refresh updated_at right before each delivery.
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", 6 * ULTRAMSG_TIMEOUT))
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedup_key TEXT UNIQUE,
+    to_phone TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    provider_response TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_due ON messages (status, next_attempt_at);
+CREATE TABLE IF NOT EXISTS rate_limit (
+    name TEXT PRIMARY KEY,
+    next_slot REAL NOT NULL
+);
+"""
+
+_local = threading.local()
+_pool = []
+_pool_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def _connect():
+    """One connection per thread; WAL lets senders and the API read while one writes."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(OUTBOX_DB, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def ultramsg_chat_endpoint():
+    return f"https://api.ultramsg.com/{ULTRAMSG_INSTANCE}/messages/chat"
+
+
+# ===== Public API =====
+def enqueue(to_phone, body, dedup_key=None):
+    """Durably queue a message and return its id.
+
+    If ``dedup_key`` was already used, nothing is inserted and the id of the
+    existing message is returned.
+    """
+    conn = _connect()
+    now = time.time()
+    cur = conn.execute(
+        "INSERT INTO messages (dedup_key, to_phone, body, status, next_attempt_at, created_at, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(dedup_key) DO NOTHING",
+        (dedup_key, to_phone, body, QUEUED, now, now, now),
+    )
+    if cur.rowcount:
+        message_id = cur.lastrowid
+    else:
+        message_id = conn.execute("SELECT id FROM messages WHERE dedup_key = ?", (dedup_key,)).fetchone()["id"]
+        logging.info("Outbox dedup hit for %s (message %s)", dedup_key, message_id)
+
+    start_sender_pool()
+    _wakeup.set()
+    return message_id
+
+
+def get_message(message_id):
+    """Delivery status of one message, or None if unknown."""
+    row = _connect().execute(
+        "SELECT id, dedup_key, to_phone, status, attempts, last_error, created_at, updated_at, sent_at "
+        "FROM messages WHERE id = ?",
+        (message_id,),
+    ).fetchone()
+    return dict(row) if row else None
+
+
+# ===== Sender pool =====
+def start_sender_pool(workers=OUTBOX_WORKERS):
+    """Start the sender threads once per process (idempotent).
+
+    Called at app startup so messages queued before a restart are delivered
+    without waiting for the next enqueue(), and again from enqueue() for
+    processes (scripts, scheduler) that did not start it.
+    """
+    if _pool:
+        return
+    with _pool_lock:
+        if _pool:
+            return
+        limiter = RateLimiter("ultramsg", OUTBOX_RATE_PER_SEC)
+        for i in range(workers):
+            t = threading.Thread(target=_sender_loop, args=(limiter,), name=f"outbox-sender-{i}", daemon=True)
+            t.start()
+            _pool.append(t)
+        logging.info("Started %d WhatsApp outbox senders", workers)
+
+
+class RateLimiter:
+    """Host-wide rate limit kept in the outbox database.
+
+    Each acquire() reserves the next free send slot in one short write
+    transaction and sleeps until it, so all sender threads of all worker
+    processes together send at most ``rate_per_sec`` messages per second.
+    """
+
+    def __init__(self, name, rate_per_sec):
+        self.name = name
+        self.interval = 1.0 / rate_per_sec
+
+    def acquire(self):
+        conn = _connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT next_slot FROM rate_limit WHERE name = ?", (self.name,)).fetchone()
+            slot = max(now, row["next_slot"] if row else now)
+            conn.execute(
+                "INSERT INTO rate_limit (name, next_slot) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET next_slot = excluded.next_slot",
+                (self.name, slot + self.interval),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _claim_next():
+    conn = _connect()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Due queued messages, or messages whose sender died mid-delivery (lease expired)
+        row = conn.execute(
+            "SELECT id, to_phone, body, attempts FROM messages "
+            "WHERE (status = ? AND next_attempt_at <= ?) OR (status = ? AND updated_at < ?) "
+            "ORDER BY next_attempt_at, id LIMIT 1",
+            (QUEUED, now, SENDING, now - OUTBOX_LEASE_SECONDS),
+        ).fetchone()
+        if row:
+            conn.execute("UPDATE messages SET status = ?, updated_at = ? WHERE id = ?", (SENDING, now, row["id"]))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return row
+
+
+def _finish(message_id, status, attempts, error=None, response=None, retry_in=None):
+    now = time.time()
+    _connect().execute(
+        "UPDATE messages SET status = ?, attempts = ?, last_error = ?, provider_response = ?, "
+        "next_attempt_at = ?, updated_at = ?, sent_at = ? WHERE id = ?",
+        (status, attempts, error, response, now + (retry_in or 0), now,
+         now if status == SENT else None, message_id),
+    )
+
+
+def _sender_loop(limiter):
+    while True:
+        try:
+            row = _claim_next()
+        except Exception:
+            logging.exception("Outbox claim failed")
+            row = None
+
+        if row is None:
+            _wakeup.wait(OUTBOX_POLL_SECONDS)
+            _wakeup.clear()
+            continue
+
+        try:
+            limiter.acquire()
+            # Renew the lease after waiting for a send slot
+            _connect().execute("UPDATE messages SET updated_at = ? WHERE id = ?", (time.time(), row["id"]))
+        except Exception:
+            # The row stays 'sending' and is claimed again once its lease expires
+            logging.exception("Outbox rate limiter failed for message %s", row["id"])
+            continue
+        _deliver(row)
+
+
+def _deliver(row):
+    message_id = row["id"]
+    attempts = row["attempts"] + 1
+    payload = {"token": ULTRAMSG_TOKEN, "to": row["to_phone"], "body": row["body"]}
+    try:
+        r = guarded_post("ultramsg", ultramsg_chat_endpoint(), ULTRAMSG_TIMEOUT, data=payload)
+        if r.status_code == 200 and "error" not in r.text.lower():
+            _finish(message_id, SENT, attempts, response=r.text[:500])
+            logging.info("Outbox message %s delivered to %s", message_id, row["to_phone"])
+            return
+        error = f"HTTP {r.status_code}: {r.text[:200]}"
+    except CircuitOpenError as e:
+        # Provider is known to be down: wait for the breaker, don't burn an attempt
+        _finish(message_id, QUEUED, row["attempts"], error=str(e), retry_in=5)
+        return
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+
+    if attempts >= OUTBOX_MAX_ATTEMPTS:
+        logging.error("Outbox message %s failed permanently: %s", message_id, error)
+        _finish(message_id, FAILED, attempts, error=error)
+    else:
+        backoff = min(2 ** attempts, 300)
+        logging.warning("Outbox message %s failed (attempt %d), retrying in %ss: %s", message_id, attempts, backoff, error)
+        _finish(message_id, QUEUED, attempts, error=error, retry_in=backoff)